@@ -0,0 +1,166 @@
+"""
+Sprite atlas bundle. The build step packs every sprite the game loads, already scaled for Constants.SCREEN_SIZE,
+into one raw RGBA atlas with an index, so the game can load all of them with a single memory-mapped read instead
+of decoding and scaling each PNG. Sprites missing from the bundle still load from their PNGs. Build it with
+
+    python Atlas.py [--out assets/sprites.atlas]
+
+and rebuild after changing any image or sprite size, or the screen size. A stale bundle is ignored.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+
+import pygame
+
+import Constants
+import Utils
+
+MAGIC = b"CPAT"
+VERSION = 1
+HEADER = struct.Struct("<4sHHHHHI")  # magic, version, screen width and height, atlas width and height, index size
+
+# Atlases are at least this wide, wider if a sprite doesn't fit
+MIN_WIDTH = 1024
+
+# Open bundle. The atlas surface reads its pixels straight from the mapping, which must stay open
+_mapping = None
+
+
+# Loads one of each object type so every sprite the game uses passes through Utils.load_image. The sprites are
+# loaded from their PNGs, never from an existing bundle
+def collect_sprites():
+    import Game
+    import Snapshot
+
+    Utils.image_bundle.clear()
+    Utils.image_cache.clear()
+    atlas_path, Constants.ATLAS_PATH = Constants.ATLAS_PATH, None
+    try:
+        Game.Manager(headless=True, populate=False)
+        for construct in Snapshot.TYPES.values():
+            construct((0, 0), 0)
+    finally:
+        Constants.ATLAS_PATH = atlas_path
+    return [(key, surface) for key, (surface, _) in Utils.image_cache.surfaces.items()]
+
+
+def pack(sizes, min_width=MIN_WIDTH):
+    """
+    Shelf packs rectangles, tallest first
+
+    :param sizes: List of (width, height)
+    :return: (atlas width, atlas height, list of (x, y) in the order of sizes)
+    """
+    width = max([min_width] + [size[0] for size in sizes])
+    positions = [None] * len(sizes)
+    x = y = shelf_height = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if x + w > width:
+            x, y = 0, y + shelf_height
+            shelf_height = 0
+        positions[i] = (x, y)
+        x += w
+        shelf_height = max(shelf_height, h)
+    return width, y + shelf_height, positions
+
+
+# Size and modification time of an image, to tell when a bundle is older than its sources
+def source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def build(path=None):
+    """
+    Writes the bundle of every sprite the game loads
+
+    :return: Number of sprites packed
+    """
+    path = Constants.ATLAS_PATH if path is None else path
+    # With a display every sprite is converted to 32 bit RGBA, as in the game
+    if pygame.display.get_surface() is None:
+        pygame.display.set_mode((1, 1))
+    sprites = collect_sprites()
+    width, height, positions = pack([surface.get_size() for _, surface in sprites])
+
+    atlas = pygame.Surface((width, height), pygame.SRCALPHA)
+    index = []
+    for ((image_path, size, flip), surface), position in zip(sprites, positions):
+        # Taking the maximum of each channel over the transparent atlas copies the pixels unchanged
+        atlas.blit(surface, position, special_flags=pygame.BLEND_RGBA_MAX)
+        index.append({"path": image_path, "size": size, "flip": flip,
+                      "rect": [position[0], position[1], surface.get_width(), surface.get_height()],
+                      "source": source_stamp(image_path)})
+
+    index_data = json.dumps(index).encode("utf-8")
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, Constants.SCREEN_SIZE[0], Constants.SCREEN_SIZE[1], width, height,
+                            len(index_data)))
+        f.write(index_data)
+        f.write(pygame.image.tobytes(atlas, "RGBA"))
+    os.replace(path + ".tmp", path)
+    return len(index)
+
+
+def load(path=None):
+    """
+    Maps the bundle and makes its sprites available to Utils.load_image. Does nothing if there is no bundle or it
+    was built for another screen size or from older images
+
+    :param path: Bundle to load, Constants.ATLAS_PATH if None. Setting that to None disables the bundle
+    :return: Whether the bundle was loaded
+    """
+    global _mapping
+    path = Constants.ATLAS_PATH if path is None else path
+    if path is None or not os.path.exists(path):
+        return False
+
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, screen_width, screen_height, width, height, index_size = HEADER.unpack_from(mapping)
+    if magic != MAGIC or version != VERSION or (screen_width, screen_height) != tuple(Constants.SCREEN_SIZE):
+        mapping.close()
+        return False
+    index = json.loads(mapping[HEADER.size:HEADER.size + index_size].decode("utf-8"))
+    try:
+        if any(source_stamp(entry["path"]) != entry["source"] for entry in index):
+            mapping.close()
+            return False
+    except OSError:
+        mapping.close()
+        return False
+
+    offset = HEADER.size + index_size
+    atlas = pygame.image.frombuffer(memoryview(mapping)[offset:offset + width * height * 4], (width, height), "RGBA")
+    # Converting copies the atlas into the display's format once, for fast blits. Without a display the atlas
+    # keeps reading from the mapping
+    if pygame.display.get_surface() is not None:
+        atlas = atlas.convert_alpha()
+
+    sprites = {}
+    for entry in index:
+        key = (entry["path"], tuple(entry["size"]) if entry["size"] is not None else None, tuple(entry["flip"]))
+        sprites[key] = atlas.subsurface(entry["rect"])
+    Utils.image_bundle.update(sprites)
+    _mapping = mapping
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", default=Constants.ATLAS_PATH, help="bundle to write")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    count = build(args.out)
+    print("Packed {} sprites into {} ({:.1f} MB)".format(count, args.out, os.path.getsize(args.out) / 2 ** 20),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Runs many independent headless worlds across a process pool, one parameter set per world, for tuning the
+creature and food parameters. Each world runs until its time limit or until every creature died, and a one-line
+summary of it is streamed back as soon as it finishes. Run from the repository root with
+
+    python Batch.py --param Creature.MAXSPEED=0.5 --param Creature.MAXSPEED=1 --seeds 100 --seconds 600 \\
+        [--workers N] [--out results.csv]
+
+Every combination of the given parameter values is run once per seed.
+"""
+import argparse
+import ast
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+# Each world runs on a single core, so numpy must not start threads of its own
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import Constants
+import Game
+import Object
+
+# Summary columns of a world, after its parameters
+METRICS = ("seed", "frames", "seconds", "died", "hunger", "thirst", "happiness", "mean_hunger", "mean_thirst",
+           "meals", "drinks", "objects")
+
+
+def set_parameters(parameters):
+    """
+    Sets class attributes of game objects, e.g. {"Creature.MAXSPEED": 2}
+
+    :return: The previous values, to be passed back to restore them
+    """
+    previous = {}
+    for name, value in parameters.items():
+        class_name, attribute = name.split(".")
+        cls = getattr(Object, class_name)
+        previous[name] = getattr(cls, attribute)
+        setattr(cls, attribute, value)
+    return previous
+
+
+def run_world(task):
+    """
+    Runs one world. Parameters are set for the duration of the world only, as the worker process is reused
+
+    :param task: (parameters, seed, seconds, dt)
+    :return: (parameters, tuple of METRICS)
+    """
+    parameters, seed, seconds, dt = task
+    previous = set_parameters(parameters)
+    try:
+        manager = Game.Manager(headless=True, seed=seed)
+        creatures = list(manager.by_tag("creature"))
+        hunger_total = thirst_total = 0
+        frames = 0
+        for frames in range(1, int(round(seconds / dt)) + 1):
+            manager.step(dt)
+            hunger_total += sum(creature.hunger for creature in creatures)
+            thirst_total += sum(creature.thirst for creature in creatures)
+            if all(creature.dead for creature in creatures):
+                break
+
+        samples = max(1, frames * len(creatures))
+        metrics = (seed, frames, frames * dt, sum(creature.dead for creature in creatures),
+                   sum(creature.hunger for creature in creatures) / max(1, len(creatures)),
+                   sum(creature.thirst for creature in creatures) / max(1, len(creatures)),
+                   sum(creature.happiness for creature in creatures) / max(1, len(creatures)),
+                   hunger_total / samples, thirst_total / samples,
+                   sum(creature.meals for creature in creatures), sum(creature.drinks for creature in creatures),
+                   len(manager.game_objects))
+    finally:
+        set_parameters(previous)
+    return parameters, metrics
+
+
+def run_batch(tasks, workers=None):
+    """
+    Runs tasks on a pool of worker processes
+
+    :param tasks: Iterable of (parameters, seed, seconds, dt), see run_world
+    :param workers: Number of processes, one per core if None
+    :return: Generator of (parameters, metrics) in the order the worlds finish
+    """
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(run_world, tasks)
+
+
+def parameter_grid(values):
+    """
+    Every combination of parameter values
+
+    :param values: Parameter name -> list of values
+    :return: List of parameter dicts
+    """
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+def parse_parameter(text):
+    name, _, value = text.partition("=")
+    class_name, _, attribute = name.partition(".")
+    if not hasattr(getattr(Object, class_name, None), attribute):
+        raise argparse.ArgumentTypeError("unknown parameter " + name)
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        raise argparse.ArgumentTypeError("invalid value for " + name + ": " + value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--param", action="append", type=parse_parameter, default=[], metavar="CLASS.ATTR=VALUE",
+                        help="parameter value to try, may be repeated. VALUE is a Python literal")
+    parser.add_argument("--seeds", type=int, default=10, help="worlds per parameter set")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--seconds", type=float, default=600, help="time limit of each world in game seconds")
+    parser.add_argument("--dt", type=float, default=1 / Constants.SIM_RATE,
+                        help="fixed time delta of each simulation step (default: as in the game)")
+    parser.add_argument("--workers", type=int, help="number of processes (default: one per core)")
+    parser.add_argument("--out", help="write the results to this CSV file instead of stdout")
+    args = parser.parse_args()
+
+    values = {}
+    for name, value in args.param:
+        values.setdefault(name, []).append(value)
+    names = list(values)
+    grid = parameter_grid(values)
+    tasks = [(parameters, seed, args.seconds, args.dt)
+             for parameters in grid for seed in range(args.first_seed, args.first_seed + args.seeds)]
+
+    out = open(args.out, "w", newline="") if args.out else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(names + list(METRICS))
+    start = time.perf_counter()
+    try:
+        for parameters, metrics in run_batch(tasks, args.workers):
+            writer.writerow([repr(parameters[name]) for name in names] +
+                            ["{:.3f}".format(value) if type(value) is float else value for value in metrics])
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print("Ran {} worlds in {:.1f}s ({:.2f} worlds/s)".format(len(tasks), elapsed, len(tasks) / elapsed),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
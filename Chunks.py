@@ -0,0 +1,362 @@
+"""
+Streaming of a large world in fixed size chunks.
+
+Chunks far from every creature and from the camera are evicted: their objects are packed with Snapshot.encode,
+removed from the manager and written to a file per chunk. When a creature or the camera comes near again the chunk
+is read back and its objects return aged by the time they were away. Ages and lifetimes are advanced in one step,
+and since objects schedule their timers from their age (e.g. Grass growth), anything that came due while the chunk
+was on disk runs at the next tick. Files are read, decompressed and decoded on a background thread, the game thread
+only attaches the finished objects.
+
+Only types with Object.STREAMED set are evicted. Creatures, whose positions decide which chunks stay, the few
+objects every creature needs (ponds) and static or collidable objects always stay in memory. Evicting those would
+rebuild the renderer's static layer and the navigation grid, dropping every cached path, each time. As chunks load
+whenever the background thread finishes them a streamed world isn't deterministic.
+
+The directory holds the part of the world that isn't in memory, so nothing is lost with it:
+- World snapshots hold the evicted chunks' data as it is, collected by the background thread (collect_stored).
+- Streaming stops by loading every chunk back (restore_all), or at the end of a session by writing every chunk out
+  (store_all). A later session streaming from the same directory picks the chunks up again, their contents replacing
+  whatever the new world started with there (adopt_stored).
+- Replacing the world with a snapshot deletes the chunks, the snapshot holds their contents (reset).
+"""
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+
+import pygame
+
+import Object
+import Snapshot
+
+MAGIC = b"CPCH"
+VERSION = 1
+HEADER = struct.Struct("<4sHq")  # magic, version, tick the chunk was evicted at
+# Names of chunk files, with the chunk's column and row
+FILE_NAME = re.compile(r"chunk_(\d+)_(\d+)\.bin$")
+
+
+class InvalidChunk(Exception):
+    def __init__(self, path, reason):
+        super().__init__("Not a valid chunk file {}: {}".format(path, reason))
+
+
+# Errors reading a missing, truncated or corrupt chunk file can raise
+READ_ERRORS = (OSError, InvalidChunk) + Snapshot.DECODE_ERRORS
+
+
+class ChunkStreamer:
+    def __init__(self, directory, world_size, chunk_size, active_radius, evict_radius, check_interval):
+        """
+
+        :param directory: Where evicted chunks are written, created if missing
+        :param world_size: (width, height) of the world
+        :param chunk_size: Side of a chunk in pixels
+        :param active_radius: Chunks within this many chunks of a creature or the camera's view are loaded
+        :param evict_radius: Chunks further than this many chunks from every creature and the view are evicted. At
+            least active_radius, the gap keeps chunks at the edge from being evicted and loaded over and over
+        :param check_interval: Ticks between checks for chunks to load and evict
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.chunk_size = chunk_size
+        self.columns = max(1, -(-world_size[0] // chunk_size))
+        self.rows = max(1, -(-world_size[1] // chunk_size))
+        self.active_radius = active_radius
+        self.evict_radius = max(evict_radius, active_radius)
+        self.check_interval = check_interval
+        self.last_check = None
+
+        # Chunks whose objects are in the manager, chunks on disk with the tick they were evicted at and chunks being
+        # read. Reads started before the last reset carry an older epoch and are ignored
+        self.resident = {(x, y) for x in range(self.columns) for y in range(self.rows)}
+        self.stored = {}
+        self.loading = set()
+        self.epoch = 0
+        # Chunks found far from everything at the last check, evicted one per frame so no frame packs many chunks
+        self.evicting = []
+
+        # One object of each streamed type constructed on the game thread. Loaded objects are cloned from these so
+        # decoding constructs nothing off the game thread
+        self.templates = {name: construct((0, 0), 0) for name, construct in Snapshot.TYPES.items()
+                          if getattr(Object, name).STREAMED}
+
+        # Jobs run in order by the background thread, so a chunk is only read after it was written. Loaded chunks
+        # come back through results
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        # Chunk -> (tick, body) of evicted chunks whose file couldn't be written, kept in memory instead. Only used by
+        # the background thread, or by the game thread after wait()
+        self.unwritten = {}
+        self.thread = threading.Thread(target=self.io_loop, name="chunks", daemon=True)
+        self.thread.start()
+
+    # Forgets every evicted chunk and deletes their files, e.g. after the world was replaced by a snapshot holding
+    # them. Chunks still being read are dropped
+    def reset(self):
+        self.wait()
+        for chunk in self.stored:
+            # Chunks whose file couldn't be written have none
+            if os.path.exists(self.path(chunk)):
+                os.remove(self.path(chunk))
+        self.resident = {(x, y) for x in range(self.columns) for y in range(self.rows)}
+        self.stored = {}
+        self.loading = set()
+        self.evicting = []
+        self.unwritten = {}
+        self.epoch += 1
+
+    # Waits for the background thread to finish every queued job
+    def wait(self):
+        self.jobs.join()
+
+    def adopt_stored(self, manager):
+        """
+        Takes over the chunks left in the directory by an earlier session. Streamed objects the world has in those
+        chunks, including queued ones, are dropped for the ones on disk. The time between the sessions doesn't count
+        towards their age
+        """
+        chunks = set()
+        for name in os.listdir(self.directory):
+            match = FILE_NAME.match(name)
+            if match is not None:
+                chunk = (int(match.group(1)), int(match.group(2)))
+                if chunk[0] < self.columns and chunk[1] < self.rows:
+                    chunks.add(chunk)
+        if not chunks:
+            return
+
+        def replaced(obj):
+            return obj.STREAMED and self.chunk_of(obj.center) in chunks
+
+        for obj in [obj for obj in manager.game_objects if replaced(obj)]:
+            manager.detach_object(obj)
+        manager.game_object_add_queue = [obj for obj in manager.game_object_add_queue if not replaced(obj)]
+        for chunk in chunks:
+            self.resident.discard(chunk)
+            self.stored[chunk] = manager.tick
+
+    def chunk_of(self, pos):
+        return (min(self.columns - 1, max(0, int(pos[0] // self.chunk_size))),
+                min(self.rows - 1, max(0, int(pos[1] // self.chunk_size))))
+
+    def chunk_rect(self, chunk):
+        return pygame.Rect(chunk[0] * self.chunk_size, chunk[1] * self.chunk_size, self.chunk_size, self.chunk_size)
+
+    def path(self, chunk):
+        return os.path.join(self.directory, "chunk_{}_{}.bin".format(*chunk))
+
+    # Chunks within radius chunks of a creature or of the camera's view
+    def chunks_near(self, manager, radius):
+        areas = [self.chunk_of(creature.center) * 2 for creature in manager.by_tag("creature")]
+        view = manager.renderer.camera.rect
+        areas.append(self.chunk_of(view.topleft) + self.chunk_of((view.right - 1, view.bottom - 1)))
+        chunks = set()
+        for x0, y0, x1, y1 in areas:
+            for x in range(max(0, x0 - radius), min(self.columns, x1 + radius + 1)):
+                for y in range(max(0, y0 - radius), min(self.rows, y1 + radius + 1)):
+                    chunks.add((x, y))
+        return chunks
+
+    # Called once per frame. Attaches a chunk that finished loading, evicts a chunk and periodically looks for chunks
+    # to load and evict
+    def update(self, manager):
+        self.attach_loaded(manager)
+        if self.evicting:
+            chunk = self.evicting.pop()
+            if chunk in self.resident:
+                self.evict(manager, chunk)
+        if self.last_check is not None and manager.tick - self.last_check < self.check_interval:
+            return
+        self.last_check = manager.tick
+
+        for chunk in self.chunks_near(manager, self.active_radius) - self.resident - self.loading:
+            if chunk in self.stored:
+                self.loading.add(chunk)
+                self.jobs.put(("read", chunk, self.epoch))
+            else:
+                self.resident.add(chunk)
+        self.evicting = list(self.resident - self.chunks_near(manager, self.evict_radius))
+
+    def evict(self, manager, chunk):
+        objects = [obj for obj in manager.spatial.query_centers(self.chunk_rect(chunk))
+                   if obj.STREAMED and not obj.kill and self.chunk_of(obj.center) == chunk]
+        self.resident.discard(chunk)
+        if not objects:
+            return
+        # Packed on the game thread so the chunk is consistent, compressed and written in the background
+        body = Snapshot.encode(objects)
+        for obj in objects:
+            manager.detach_object(obj)
+        self.stored[chunk] = manager.tick
+        self.jobs.put(("write", chunk, (manager.tick, body)))
+
+    # Adds the objects of a loaded chunk to the manager, aged by the ticks the chunk spent on disk. One chunk per
+    # frame, the others wait for the next frames. Returns whether a chunk was attached
+    def attach_loaded(self, manager):
+        while True:
+            try:
+                chunk, epoch, result = self.results.get_nowait()
+            except queue.Empty:
+                return False
+            if epoch == self.epoch:
+                break
+        self.loading.discard(chunk)
+        if isinstance(result, Exception):
+            self.drop(chunk, result)
+        else:
+            self.attach(manager, chunk, result)
+            # The file is only removed now, a snapshot taken while the chunk was loading still reads it
+            self.jobs.put(("remove", chunk, None))
+        return True
+
+    # Gives up on a chunk whose file can't be read. Its objects are lost, the file is kept aside as .bad
+    def drop(self, chunk, error):
+        print("Dropping chunk {}: {}".format(chunk, error), file=sys.stderr)
+        self.stored.pop(chunk, None)
+        self.resident.add(chunk)
+        path = self.path(chunk)
+        if os.path.exists(path):
+            os.replace(path, path + ".bad")
+
+    def attach(self, manager, chunk, objects):
+        alive, expired = self.caught_up(manager, self.stored.pop(chunk), objects)
+        self.resident.add(chunk)
+        for obj in alive:
+            manager.attach_object(obj)
+        for obj in expired:
+            if obj.POOLED:
+                manager.release(obj)
+
+    # Ages objects loaded from a chunk by the ticks since it was evicted. Returns (objects still alive, objects whose
+    # lifetime ran out while away)
+    @staticmethod
+    def caught_up(manager, evicted_tick, objects):
+        return Snapshot.age(objects, manager.tick - evicted_tick)
+
+    # Waits for the background thread and attaches every chunk it finished loading
+    def finish_loading(self, manager):
+        self.wait()
+        while self.attach_loaded(manager):
+            pass
+
+    def collect_stored(self, manager):
+        """
+        Gathers the data of every evicted chunk for a world snapshot, as Snapshot parts. The background thread reads
+        the files after every job queued so far, nothing is read or decoded on the game thread
+
+        :return: Queue receiving the list of (ticks since the chunk was evicted, its snapshot data)
+        """
+        reply = queue.Queue()
+        chunks = [(chunk, manager.tick - evicted_tick) for chunk, evicted_tick in self.stored.items()]
+        self.jobs.put(("collect", None, (chunks, reply)))
+        return reply
+
+    # Loads every evicted chunk back into the world on the game thread
+    def restore_all(self, manager):
+        self.finish_loading(manager)
+        for chunk in list(self.stored):
+            try:
+                loaded = self.read_stored(chunk)
+            except READ_ERRORS as e:
+                self.drop(chunk, e)
+                continue
+            self.attach(manager, chunk, loaded)
+
+    # Evicts every chunk, so the whole streamed world is on disk for a later session. Chunks that couldn't be written
+    # go back into the world
+    def store_all(self, manager):
+        self.finish_loading(manager)
+        for chunk in list(self.resident):
+            self.evict(manager, chunk)
+        self.wait()
+        for chunk in list(self.unwritten):
+            self.attach(manager, chunk, self.read_stored(chunk))
+
+    # Runs ("write", chunk, (tick, body)), ("read", chunk, epoch), ("remove", chunk, None) and
+    # ("collect", None, (chunks, reply)) jobs until a ("stop", None, None) job. A failing job never ends the loop, the
+    # game thread waits on every job being done
+    def io_loop(self):
+        while True:
+            job, chunk, argument = self.jobs.get()
+            try:
+                if job == "stop":
+                    return
+                if job == "write":
+                    self.write(chunk, *argument)
+                elif job == "read":
+                    try:
+                        result = self.read_stored(chunk, remove=False)
+                    except READ_ERRORS as e:
+                        result = e
+                    self.results.put((chunk, argument, result))
+                elif job == "remove":
+                    self.unwritten.pop(chunk, None)
+                    if os.path.exists(self.path(chunk)):
+                        os.remove(self.path(chunk))
+                else:
+                    self.collect(*argument)
+            except Exception as e:
+                print("Chunk {} job {} failed: {}".format(chunk, job, e), file=sys.stderr)
+            finally:
+                self.jobs.task_done()
+
+    # Answers collect_stored. A chunk that can't be read is left out, it is dropped when it is next loaded
+    def collect(self, chunks, reply):
+        parts = []
+        try:
+            for chunk, ticks in chunks:
+                try:
+                    if chunk in self.unwritten:
+                        data = Snapshot.compress(self.unwritten[chunk][1])
+                    else:
+                        with open(self.path(chunk), "rb") as f:
+                            data = f.read()[HEADER.size:]
+                except OSError as e:
+                    print("Leaving chunk {} out of the snapshot: {}".format(chunk, e), file=sys.stderr)
+                    continue
+                parts.append((ticks, data))
+        finally:
+            reply.put(parts)
+
+    # Writes an evicted chunk to its file. If that fails (e.g. the disk is full) the body is kept in memory, so the
+    # chunk still loads
+    def write(self, chunk, tick, body):
+        try:
+            Snapshot.write_file(self.path(chunk), HEADER.pack(MAGIC, VERSION, tick) + Snapshot.compress(body))
+        except OSError as e:
+            print("Keeping chunk {} in memory, writing it failed: {}".format(chunk, e), file=sys.stderr)
+            self.unwritten[chunk] = (tick, body)
+        else:
+            self.unwritten.pop(chunk, None)
+
+    # Objects of an evicted chunk, from memory if its file couldn't be written. The chunk is forgotten unless remove is
+    # False
+    def read_stored(self, chunk, remove=True):
+        if chunk in self.unwritten:
+            body = self.unwritten.pop(chunk)[1] if remove else self.unwritten[chunk][1]
+            return Snapshot.decode(body, self.templates)
+        return self.read(self.path(chunk), remove)[1]
+
+    # Reads and decodes an evicted chunk, then removes its file unless remove is False. Returns (tick it was
+    # evicted at, objects)
+    def read(self, path, remove=True):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise InvalidChunk(path, "file is truncated")
+        magic, version, tick = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise InvalidChunk(path, "bad magic number or version")
+        objects = Snapshot.decode(Snapshot.decompress(data[HEADER.size:]), self.templates)
+        if remove:
+            os.remove(path)
+        return tick, objects
+
+    # Finishes writing evicted chunks and stops the background thread. Evicted chunks stay on disk
+    def close(self):
+        self.jobs.put(("stop", None, None))
+        self.thread.join()
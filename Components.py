@@ -0,0 +1,168 @@
+"""
+Component storage of the objects in a manager. Instead of each object keeping its own lists and rects, the state the
+manager and renderer go over every frame lives in one row per object of contiguous arrays: center, center before the
+last step, render rect, z order and flags. Whole-world passes (recording positions for interpolation, culling,
+sorting in draw order) are then a few array operations however many objects there are, and only the objects that
+come out of them are touched.
+
+Objects stay the owners of their centers, which behaviour code keeps changing in place. Object.update_rects queues
+the object, and its row is copied over with every other moved object at once the next time the store is read.
+"""
+import numpy as np
+
+import Object
+
+# Row flags. Free rows have none set
+AWAKE = 1  # The object runs every frame
+RENDER = 2  # The object is drawn, Object.do_render
+INTERPOLATE = 4  # previous holds the object's center before the last step, Object.previous_center
+CULLED = 8  # bounds hold the world area the object is drawn in, so it can be culled with the others at once
+
+
+class ComponentStore:
+    def __init__(self, capacity=256):
+        """
+
+        :param capacity: Rows allocated up front, the arrays double in size when they run out
+        """
+        self.capacity = 0
+        self.center = np.zeros((0, 2))
+        self.previous = np.zeros((0, 2))
+        self.bounds = np.zeros((0, 4), dtype=np.int32)  # x, y, width, height
+        self.z_order = np.zeros(0, dtype=np.int32)
+        # Number of the object in the order objects were added, keeps objects with equal z order in that order
+        self.order = np.zeros(0, dtype=np.int64)
+        self.flags = np.zeros(0, dtype=np.uint8)
+        self._reserve(capacity)
+
+        # Object of each row, rows freed by removed objects to be reused and rows in use or freed so far
+        self.objects = []
+        self.free = []
+        self.size = 0
+        self.added = 0
+
+        # Objects whose center or rects changed since the store was last synced. Dicts are used as insertion
+        # ordered sets
+        self.moved = {}
+
+    def _reserve(self, count):
+        if count <= self.capacity:
+            return
+        capacity = max(count, self.capacity * 2)
+        for name in ("center", "previous", "bounds", "z_order", "order", "flags"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.size - len(self.free)
+
+    # Gives an object a row, filled from its current state. Called by the manager when the object enters the world
+    def add(self, obj):
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = self.size
+            self._reserve(row + 1)
+            self.objects.append(None)
+            self.size += 1
+        self.objects[row] = obj
+        obj.row = row
+
+        previous = obj._previous_center
+        flags = 0
+        if not obj.sleeping:
+            flags |= AWAKE
+        if obj._do_render:
+            flags |= RENDER
+        if previous is not None:
+            flags |= INTERPOLATE
+            self.previous[row] = previous
+        if not obj.SCREEN_SPACE and type(obj).get_render_rect is Object.Object.get_render_rect:
+            flags |= CULLED
+        self.flags[row] = flags
+        self.z_order[row] = obj.z_order
+        self.order[row] = self.added
+        self.added += 1
+        self.center[row] = obj.center
+        self.bounds[row] = obj.get_render_rect()
+
+    # Frees an object's row, handing the state only kept in the store back to the object
+    def remove(self, obj):
+        row = obj.row
+        obj._previous_center = obj.previous_center
+        obj.row = None
+        self.moved.pop(obj, None)
+        self.objects[row] = None
+        self.flags[row] = 0
+        self.free.append(row)
+
+    def set_flag(self, obj, flag, value):
+        if value:
+            self.flags[obj.row] |= flag
+        else:
+            self.flags[obj.row] &= ~np.uint8(flag)
+
+    # Queues the object's row to be updated from its center and rects
+    def mark_moved(self, obj):
+        self.moved[obj] = None
+
+    # Copies the center and render rect of every object that moved since the last sync into their rows
+    def sync(self):
+        if not self.moved:
+            return
+        moved = list(self.moved)
+        self.moved = {}
+        rows = [obj.row for obj in moved]
+        self.center[rows] = [obj.center for obj in moved]
+        self.bounds[rows] = [tuple(obj.get_render_rect()) for obj in moved]
+
+    # Records the center of every awake object at the start of a simulation step, drawing interpolates from it
+    def begin_step(self):
+        self.sync()
+        awake = (self.flags[:self.size] & AWAKE) != 0
+        self.previous[:self.size][awake] = self.center[:self.size][awake]
+        self.flags[:self.size][awake] |= INTERPOLATE
+
+    def previous_center(self, obj):
+        row = obj.row
+        if not self.flags[row] & INTERPOLATE:
+            return None
+        x, y = self.previous[row].tolist()
+        return x, y
+
+    def visible(self, view, alpha):
+        """
+        Finds the objects to draw in a frame. Objects with their rects in the store are culled against view here,
+        the others are left for the caller to test
+
+        :param view: World area being drawn
+        :param alpha: Fraction of a simulation step since the last step
+        :return: (objects in draw order, whether each still needs culling, draw offset of each, number of drawn
+            objects culled here)
+        """
+        self.sync()
+        size = self.size
+        flags = self.flags[:size]
+        x, y, width, height = self.bounds[:size].T
+        inside = ((x < view.right) & (x + width > view.x) & (y < view.bottom) & (y + height > view.y) &
+                  (width > 0) & (height > 0))
+        rendered = (flags & RENDER) != 0
+        culled = (flags & CULLED) != 0
+        rows = np.flatnonzero(rendered & (inside | ~culled))
+        rows = rows[np.lexsort((self.order[rows], self.z_order[rows]))]
+
+        # Offsets to draw moving objects at in between their centers before and after the last step, see
+        # Object.draw_offset
+        offsets = [(0, 0)] * len(rows)
+        moving = np.flatnonzero(flags[rows] & INTERPOLATE)
+        if len(moving):
+            deltas = np.round((self.previous[rows[moving]] - self.center[rows[moving]]) * (1 - alpha))
+            for i, dx, dy in zip(moving.tolist(), *deltas.astype(np.int64).T.tolist()):
+                offsets[i] = (dx, dy)
+
+        objects = self.objects
+        return ([objects[row] for row in rows.tolist()], (~culled[rows]).tolist(), offsets,
+                int(np.count_nonzero(rendered & culled)) - int(np.count_nonzero(culled[rows])))
@@ -1 +1,80 @@
 SCREEN_SIZE = (850, 700)
+
+# Simulation steps per second. Ages, lifetimes and animations are counted in steps, so the world runs at the same
+# speed whatever the frame rate. Frames are capped at MAX_FPS and draw moving objects in between steps. A frame
+# runs at most MAX_SIM_STEPS steps, a slower game drops time instead of falling further behind
+SIM_RATE = 30
+MAX_FPS = 120
+MAX_SIM_STEPS = 5
+
+# Size of the world in pixels. The screen shows the part of it the camera is on, panned with the arrow keys, and
+# objects outside of it aren't drawn. Pixels per second the camera pans at
+WORLD_SIZE = SCREEN_SIZE
+CAMERA_PAN_SPEED = 600
+
+# Maximum number of bytes of pixel data kept by the shared image cache
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Bundle of pre-scaled sprites written by Atlas.py. Sprites load from their PNGs when it is missing or stale
+ATLAS_PATH = "assets/sprites.atlas"
+
+# Number of recently rendered strings kept by the shared text cache
+TEXT_CACHE_SIZE = 128
+
+# Rotated sprites are rounded to multiples of this many degrees so each angle is only resampled once, and the
+# number of bytes of pixel data the rotation cache may hold
+ROTATION_STEP = 2
+ROTATION_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Side length in pixels of a cell of the spatial hash used for neighbour queries
+SPATIAL_CELL_SIZE = 100
+
+# Moves creatures with the vectorized Steering.SteeringSystem instead of per-creature Creature.go_to
+BATCHED_STEERING = False
+
+# Longest time in seconds creature steering is integrated over at once. Steering was tuned at 120 frames per second
+# and overshoots, growing without bound, over much longer steps, so each simulation step is split into sub-steps
+# of at most this long
+STEERING_STEP = 1 / 120
+
+# Keeps the positions, render rects and flags of objects in the arrays of Components.ComponentStore, so the update
+# loop and the renderer process every object at once instead of one at a time
+COMPONENT_STORE = True
+
+# Only redraw the parts of the screen that changed each frame instead of the whole screen. Toggled in game with F2
+DIRTY_RECT_RENDERING = False
+
+# Time every phase of the game loop from the start instead of only while the profiler overlay is open
+PROFILER_ENABLED = False
+
+# Frames kept by the frame profiler, and frames shown by its overlay (F3). F4 dumps the profile to a CSV file
+PROFILER_FRAMES = 1024
+PROFILER_GRAPH_FRAMES = 240
+
+# Telemetry log (see Telemetry). Ticks between creature stat samples (a quarter of a second), seconds between writes
+# and maximum number of samples buffered between writes
+TELEMETRY_SAMPLE_INTERVAL = max(1, round(SIM_RATE / 4))
+TELEMETRY_FLUSH_INTERVAL = 1.0
+TELEMETRY_BUFFER_SIZE = 65536
+
+# World snapshot written by F5 and read back by F9, and seconds of game time between autosaves
+SAVE_PATH = "calpal.save"
+AUTOSAVE_INTERVAL = 60
+
+# Creatures walk A* paths around collidable objects instead of steering straight at their target and pushing away
+# from obstacles. Side in pixels of a navigation grid cell, distance paths keep from obstacles and number of cached
+# paths
+NAVIGATION = True
+NAV_CELL_SIZE = 25
+NAV_CLEARANCE = 40
+NAV_CACHE_SIZE = 4096
+
+# Maximum number of dead objects kept for reuse per pooled object type, see Manager.spawn
+POOL_SIZE = 256
+
+# World streaming (see Chunks). Side of a chunk in pixels, distance in chunks from creatures and the camera within
+# which chunks are loaded and beyond which they are evicted, and ticks between checks
+CHUNK_SIZE = 500
+CHUNK_ACTIVE_RADIUS = 1
+CHUNK_EVICT_RADIUS = 2
+CHUNK_CHECK_INTERVAL = 60
@@ -1,38 +1,102 @@
+import os
 import random
+import time
 
 import pygame
 
+import Atlas
+import Chunks
+import Components
 import Constants
+import Navigation
 import Object
+import Profiler
 import Renderer
+import Replay
+import Scheduler
+import Snapshot
+import Spatial
+import Steering
+import Telemetry
 import Utils
+import ZOrder
 
 
 class Manager:
-    def __init__(self):
+    EMPTY_TAG = {}
+
+    def __init__(self, headless=False, populate=True, seed=None, world_size=None):
+        """
+
+        :param headless: Don't open a window. The world can then only be advanced with simulate()
+        :param populate: Add the starting objects. Without them the world is empty
+        :param seed: Seed of the world's random number generator. Worlds with the same seed and input behave the same
+        :param world_size: (width, height) of the world, Constants.WORLD_SIZE if None
+        """
         # Screen window
-        self.screen = pygame.display.set_mode(Constants.SCREEN_SIZE, pygame.DOUBLEBUF)
+        self.headless = headless
+        self.screen = None if headless else pygame.display.set_mode(Constants.SCREEN_SIZE, pygame.DOUBLEBUF)
         self.running = True
 
+        # Loads every sprite from the atlas bundle at once if it has been built
+        if not Utils.image_bundle:
+            Atlas.load()
+
+        # Every random decision in the world comes from this generator, so a seeded world is deterministic
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        # Mouse position on the screen for this frame. Objects read it from here instead of from pygame so it can be
+        # replayed
+        self.mouse_pos = (0, 0)
+
+        # Objects are positioned in world coordinates, the renderer's camera decides which part is on the screen
+        self.world_size = tuple(world_size if world_size is not None else Constants.WORLD_SIZE)
+        self.renderer = Renderer.Renderer(Constants.DIRTY_RECT_RENDERING,
+                                          Renderer.Camera(Constants.SCREEN_SIZE, self.world_size))
+
         # All the game objects
         self.background_image = Utils.load_image("assets/images/background.png", Utils.cscale(850, 700))
-        self.game_objects = []
+        self.game_objects = ZOrder.ZOrderedObjects()
         self.game_object_add_queue = []
         self.game_object_delete_queue = []
 
+        # Objects that run every frame, in z order. The others sleep until woken, see Object.sleeping
+        self.awake_objects = ZOrder.ZOrderedObjects()
+
+        # Frames completed so far. Object ages and lifetimes are measured in ticks
+        self.tick = 0
+
+        # Future callbacks of objects, run at the end of the frame they are due in
+        self.scheduler = Scheduler.Scheduler()
+
+        # Maps each tag to the objects carrying it. Dicts are used as insertion ordered sets
+        self.tag_index = {}
+
+        # Grid of object positions for neighbour queries, kept current by Object.update_rects
+        self.spatial = Spatial.SpatialHash(Constants.SPATIAL_CELL_SIZE)
+
+        # Grid of the cells blocked by collidable objects, creatures find their way around them on it
+        self.navigation = None
+        if Constants.NAVIGATION:
+            self.navigation = Navigation.NavGrid(Constants.NAV_CELL_SIZE, self.world_size,
+                                                 Constants.NAV_CLEARANCE, Constants.NAV_CACHE_SIZE)
+
+        # Moves all creatures at once when batched steering is on, otherwise each creature steers itself
+        self.steering = Steering.SteeringSystem() if Constants.BATCHED_STEERING else None
+
+        # Arrays of the positions, render rects and flags of every object in the world, so the renderer and the
+        # update loop go over all of them at once, see Components
+        self.components = Components.ComponentStore() if Constants.COMPONENT_STORE else None
+
+        # Dead objects of pooled types, by type, waiting to be reused by spawn. Counts of objects constructed by
+        # spawn, reused, released into a pool and dropped because their pool was full
+        self.pools = {}
+        self.pool_counts = {"constructed": 0, "reused": 0, "released": 0, "dropped": 0}
+
         # Adds starting objects
-        self.add_object(Object.GUI(None, 999, [i / 2 for i in Constants.SCREEN_SIZE]))
-        self.add_object(Object.Shack(None, (725, 125)))
-        self.add_object(Object.Pond(None, (450, 520)))
-        #self.add_object(Object.Grass(None, (200, 200)))
-        #self.add_object(Object.Snack(None, (300, 400)))
-        for i in range(2, 3):
-            self.add_object(Object.Grass(None, (
-                random.randint(0, Constants.SCREEN_SIZE[0]), random.randint(0, Constants.SCREEN_SIZE[1]))))
-            self.add_object(Object.Snack(None, (
-                random.randint(0, Constants.SCREEN_SIZE[0]), random.randint(0, Constants.SCREEN_SIZE[1]))))
-        self.add_object(Object.Creature(None, [450, 250]))
-        self.update_objects()
+        if populate:
+            self.populate()
 
         # Game events
         self.events = []
@@ -44,40 +108,363 @@ class Manager:
         self.ticks_last_frame = pygame.time.get_ticks()
 
         # Class instances
-        self.renderer = Renderer.Renderer()
+        self.profiler = Profiler.FrameProfiler()
+        self.profiler.enabled = Constants.PROFILER_ENABLED
+
+        # Periodically saves the world in the background, see enable_autosave
+        self.autosaver = None
+
+        # Moves the parts of the world far from creatures and the camera to disk, see enable_streaming
+        self.streamer = None
+
+        # Log objects push samples of their state to, see enable_telemetry
+        self.telemetry = None
+
+        # Records the input of each frame so the session can be replayed, see start_recording
+        self.recorder = None
+
+    def populate(self):
+        self.add_object(Object.GUI(None, 999, [i / 2 for i in Constants.SCREEN_SIZE]))
+        self.add_object(Object.Shack(None, (725, 125)))
+        self.add_object(Object.Pond(None, (450, 520)))
+        #self.add_object(Object.Grass(None, (200, 200)))
+        #self.add_object(Object.Snack(None, (300, 400)))
+        for i in range(2, 3):
+            self.spawn(Object.Grass, None, (
+                self.rng.randint(0, self.world_size[0]), self.rng.randint(0, self.world_size[1])))
+            self.spawn(Object.Snack, None, (
+                self.rng.randint(0, self.world_size[0]), self.rng.randint(0, self.world_size[1])))
+        self.add_object(Object.Creature(None, [450, 250]))
+        self.update_objects()
 
     def add_object(self, obj):
         self.game_object_add_queue.append(obj)
 
+    def spawn(self, cls, lifetime, pos, tags=()):
+        """
+        Queues a new object of a type taking (lifetime, pos, tags), reusing a dead one from the type's pool if there
+        is one
+
+        :return: The object
+        """
+        pool = self.pools.get(cls)
+        if pool:
+            obj = pool.pop()
+            obj.reset(lifetime, pos, tags)
+            self.pool_counts["reused"] += 1
+        else:
+            obj = cls(lifetime, pos, tags)
+            self.pool_counts["constructed"] += 1
+        self.add_object(obj)
+        return obj
+
+    # Keeps a dead object of a pooled type for reuse, up to Constants.POOL_SIZE objects per type
+    def release(self, obj):
+        pool = self.pools.setdefault(type(obj), [])
+        if len(pool) < Constants.POOL_SIZE:
+            pool.append(obj)
+            self.pool_counts["released"] += 1
+        else:
+            self.pool_counts["dropped"] += 1
+
+    # Fraction of spawned objects that were reused from a pool
+    def pool_reuse_rate(self):
+        spawned = self.pool_counts["constructed"] + self.pool_counts["reused"]
+        return self.pool_counts["reused"] / spawned if spawned else 0
+
+    # Mouse position in the world
+    @property
+    def world_mouse_pos(self):
+        return self.renderer.camera.to_world(self.mouse_pos)
+
+    # Returns the objects carrying tag as a live, read-only view
+    def by_tag(self, tag):
+        return self.tag_index.get(tag, Manager.EMPTY_TAG).keys()
+
+    # Called by an object's TagSet when it gains a tag
+    def tag_object(self, obj, tag):
+        self.tag_index.setdefault(tag, {})[obj] = None
+        if tag == "collidable" and self.navigation is not None:
+            self.navigation.block(obj)
+
+    # Called by an object's TagSet when it loses a tag
+    def untag_object(self, obj, tag):
+        if tag == "collidable" and self.navigation is not None:
+            self.navigation.unblock(obj)
+        tagged = self.tag_index.get(tag)
+        if tagged is not None:
+            tagged.pop(obj, None)
+            if not tagged:
+                del self.tag_index[tag]
+
     def update_objects(self):
         # Checks queue
         if len(self.game_object_add_queue):
 
-            # Add queued objects
+            # Add queued objects. The container keeps them in z order for rendering
             for obj in self.game_object_add_queue:
-                self.game_objects.append(obj)
-
-            # Sort list for rendering
-            self.game_objects.sort(key=lambda i: i.z_order)
+                self.attach_object(obj)
 
             # Clear queue
             self.game_object_add_queue = []
 
-        # Manage object life
-        for obj in self.game_objects:
-            obj.exist_time += 1
-            if obj.lifetime is not None:
-                obj.lifetime -= 1
-            if (obj.lifetime is not None and obj.lifetime <= 0) or obj.kill:
-                self.game_object_delete_queue.append(obj)
+        # Advances time and runs the timers that came due. Expired and killed objects queue themselves for deletion
+        self.tick += 1
+        self.scheduler.run_due(self.tick)
 
-        # Deletes queued objects and clears delete queue
+        # Deletes queued objects and clears delete queue. Dead objects of pooled types are kept for reuse
         for obj in self.game_object_delete_queue:
-            if obj in self.game_objects:
-                self.game_objects.remove(obj)
+            if obj.manager is self:
+                self.detach_object(obj)
+                if obj.POOLED:
+                    self.release(obj)
         self.game_object_delete_queue = []
 
+    # Adds an object to the world and its indices immediately, without going through the add queue
+    def attach_object(self, obj):
+        if obj in self.game_objects:
+            return
+        self.game_objects.add(obj)
+        if not obj.sleeping:
+            self.awake_objects.add(obj)
+        obj.manager = self
+        for tag in obj.tags:
+            self.tag_object(obj, tag)
+        self.spatial.insert(obj)
+        if self.components is not None:
+            self.components.add(obj)
+        obj.on_add(self)
+
+    # Removes an object from the world and its indices immediately
+    def detach_object(self, obj):
+        if obj not in self.game_objects:
+            return
+        obj.on_remove(self)
+        self.game_objects.remove(obj)
+        self.awake_objects.discard(obj)
+        for tag in obj.tags:
+            self.untag_object(obj, tag)
+        self.spatial.remove(obj)
+        if obj.row is not None:
+            self.components.remove(obj)
+        obj.manager = None
+
+    # Called when an object in the world falls asleep or wakes up
+    def set_sleeping(self, obj, sleeping):
+        if sleeping:
+            self.awake_objects.discard(obj)
+            # Sleeping objects don't move, so they are drawn where they are
+            obj.previous_center = None
+        else:
+            self.awake_objects.add(obj)
+        if obj.row is not None:
+            self.components.set_flag(obj, Components.AWAKE, not sleeping)
+
+    # Removes every object, including queued ones
+    def clear_objects(self):
+        for obj in list(self.game_objects):
+            self.detach_object(obj)
+        self.game_object_add_queue = []
+        self.game_object_delete_queue = []
+
+    # Saves the whole world to a snapshot file
+    def save(self, path):
+        Snapshot.save(self, path)
+
+    # Queue receiving the parts of the world a snapshot holds besides the objects in memory, the chunks evicted by
+    # streaming (see ChunkStreamer.collect_stored). None if nothing is kept apart
+    def snapshot_parts(self):
+        if self.streamer is None:
+            return None
+        return self.streamer.collect_stored(self)
+
+    # Replaces the world with the one saved in a snapshot file
+    def load(self, path):
+        with open(path, "rb") as f:
+            self.restore(f.read())
+
+    # Replaces the world with the one in a snapshot file's data. Chunks evicted by streaming are deleted, the snapshot
+    # holds the whole world. A session being recorded records the snapshot, so its replay loads it at the same point
+    def restore(self, data):
+        Snapshot.restore(self, data)
+        if self.streamer is not None:
+            self.streamer.reset()
+        if self.recorder is not None:
+            self.recorder.record_load(data)
+
+    # Advances the world by one simulation step and draws it unless headless. Returns the screen rects that changed,
+    # or None if the whole screen did
+    def step(self, time_delta):
+        self.advance(time_delta)
+        if self.headless:
+            return None
+        return self.draw(time_delta)
+
+    # Advances the world by one simulation step without drawing it
+    def advance(self, time_delta):
+        if self.profiler.enabled:
+            return self.advance_profiled(time_delta)
+
+        # Pans the view before objects read the mouse position in the world
+        self.renderer.camera.update(self.events, time_delta)
+        if self.telemetry is not None:
+            self.telemetry.begin_step(self.tick)
+
+        # Positions at the start of the step, drawing interpolates from them
+        self.record_previous_centers()
+
+        # Run objects
+        for obj in self.awake_objects:
+            obj.run_sprite(self, time_delta)
+        if self.steering is not None:
+            self.steering.step(self, time_delta)
+
+        # Updates objects (adds new, delete old)
+        self.update_objects()
+
+        if self.autosaver is not None:
+            self.autosaver.update(self, time_delta)
+        if self.streamer is not None:
+            self.streamer.update(self)
+
+    # Same as advance, with each phase timed by the profiler
+    def advance_profiled(self, time_delta):
+        profiler = self.profiler
+
+        self.renderer.camera.update(self.events, time_delta)
+        if self.telemetry is not None:
+            self.telemetry.begin_step(self.tick)
+        self.record_previous_centers()
+        for obj in self.awake_objects:
+            profiler.run_sprite(obj, self, time_delta)
+        if self.steering is not None:
+            start = time.perf_counter()
+            self.steering.step(self, time_delta)
+            profiler.add("steering", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        self.update_objects()
+        profiler.add("update_objects", time.perf_counter() - start)
+
+        if self.autosaver is not None:
+            start = time.perf_counter()
+            self.autosaver.update(self, time_delta)
+            profiler.add("autosave", time.perf_counter() - start)
+        if self.streamer is not None:
+            start = time.perf_counter()
+            self.streamer.update(self)
+            profiler.add("streaming", time.perf_counter() - start)
+
+    # Remembers the center of every awake object before the step moves it, see Object.draw_offset
+    def record_previous_centers(self):
+        if self.components is not None:
+            self.components.begin_step()
+            return
+        for obj in self.awake_objects:
+            obj.previous_center = (obj.center[0], obj.center[1])
+
+    def draw(self, time_delta, alpha=1.0):
+        """
+        Draws the world
+
+        :param time_delta: Seconds since the last frame was drawn
+        :param alpha: Fraction of a simulation step since the last one. Moving objects are drawn this far between
+            their positions before and after the last step
+        :return: Screen rects that changed, or None if the whole screen did
+        """
+        return self.renderer.render(self, self.screen, time_delta, alpha)
+
+    # Saves the world to path every interval seconds of game time, writing the file off the main thread
+    def enable_autosave(self, path, interval=Constants.AUTOSAVE_INTERVAL):
+        self.disable_autosave()
+        self.autosaver = Snapshot.AutoSaver(path, interval)
+
+    # Stops autosaving, after writing any snapshot still pending
+    def disable_autosave(self):
+        if self.autosaver is not None:
+            self.autosaver.close()
+            self.autosaver = None
+
+    # Keeps only the chunks of the world near creatures and the camera in memory, evicting the others to directory.
+    # Chunks an earlier session left in directory replace what the world has in them
+    def enable_streaming(self, directory):
+        self.disable_streaming()
+        self.streamer = Chunks.ChunkStreamer(directory, self.world_size, Constants.CHUNK_SIZE,
+                                             Constants.CHUNK_ACTIVE_RADIUS, Constants.CHUNK_EVICT_RADIUS,
+                                             Constants.CHUNK_CHECK_INTERVAL)
+        self.streamer.adopt_stored(self)
+
+    def disable_streaming(self, keep_on_disk=False):
+        """
+        Stops streaming
+
+        :param keep_on_disk: Write the whole streamed world to the directory for a later session instead of loading
+            the evicted chunks back into the world. Used when the session ends
+        """
+        if self.streamer is not None:
+            if keep_on_disk:
+                self.streamer.store_all(self)
+            else:
+                self.streamer.restore_all(self)
+            self.streamer.close()
+            self.streamer = None
+
+    # Logs creature stats, food and calories spent to path, written by a background thread
+    def enable_telemetry(self, path):
+        self.disable_telemetry()
+        self.telemetry = Telemetry.Telemetry(path)
+
+    # Stops logging after the buffered samples were written
+    def disable_telemetry(self):
+        if self.telemetry is not None:
+            self.telemetry.close()
+            self.telemetry = None
+
+    # Records the session to path. The world must be seeded for the recording to be replayable
+    def start_recording(self, path):
+        if self.seed is None:
+            raise ValueError("Only a seeded world can be recorded")
+        self.stop_recording()
+        self.recorder = Replay.Recorder(path, self.seed)
+
+    # Ends the recording with the digest of the current world
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close(self)
+            self.recorder = None
+
+    def toggle_profiler_overlay(self):
+        self.profiler.overlay = not self.profiler.overlay
+        self.profiler.enabled = self.profiler.overlay or Constants.PROFILER_ENABLED
+
+    def simulate(self, seconds, dt=1 / Constants.SIM_RATE):
+        """
+        Runs the world without rendering or waiting on the clock, as fast as possible
+
+        :param seconds: Simulated time to run for
+        :param dt: Fixed time delta of each simulated frame, in seconds
+        :return: Number of frames simulated
+        """
+        frames = int(round(seconds / dt))
+        self.events = []
+        for frame in range(frames):
+            if not self.running:
+                return frame
+            if self.profiler.enabled:
+                self.profiler.begin_frame()
+                self.step(dt)
+                self.profiler.end_frame()
+            else:
+                self.step(dt)
+        return frames
+
     def start_game(self):
+        # The world advances in fixed steps of sim_dt, as many as the time since the last frame holds, and is drawn
+        # once per frame in between its last two steps. The remaining time carries over in the accumulator
+        sim_dt = 1 / Constants.SIM_RATE
+        accumulator = 0
+        # Events of frames in which no step ran, handed to the next step
+        pending_events = []
         while self.running:
 
             # Updates time delta
@@ -86,35 +473,83 @@ class Manager:
             deltaTime = (t - self.ticks_last_frame) / 1000.0
             self.ticks_last_frame = t
 
-            # Clears screen
-            self.screen.fill((0, 0, 0))
+            profiling = self.profiler.enabled
+            if profiling:
+                self.profiler.begin_frame()
+                start = time.perf_counter()
 
             # Gets events
-            self.events = pygame.event.get()
+            events = pygame.event.get()
+            pending_events += events
             # Closes game on quit
-            for event in self.events:
+            for event in events:
                 if event.type == pygame.QUIT:
                     self.running = False
+                elif event.type == pygame.KEYDOWN:
+                    # Switches between full and dirty rect rendering
+                    if event.key == pygame.K_F2:
+                        self.renderer.toggle_dirty_rects()
+                    # Profiler overlay and dump
+                    elif event.key == pygame.K_F3:
+                        self.toggle_profiler_overlay()
+                    elif event.key == pygame.K_F4:
+                        self.profiler.dump(time.strftime("profile-%Y%m%d-%H%M%S.csv"))
+                    # Quick save and load
+                    elif event.key == pygame.K_F5:
+                        self.save(Constants.SAVE_PATH)
+                    elif event.key == pygame.K_F9 and os.path.exists(Constants.SAVE_PATH):
+                        self.load(Constants.SAVE_PATH)
+
+            self.mouse_pos = pygame.mouse.get_pos()
 
-            # Run objects
-            for obj in self.game_objects:
-                obj.run_sprite(self, deltaTime)
+            if profiling:
+                self.profiler.add("event pump", time.perf_counter() - start)
 
-            # Render
-            self.renderer.render(self, self.screen, deltaTime)
+            # Runs and updates objects. Time the simulation can't catch up on is dropped instead of making the next
+            # frames slower still
+            accumulator += deltaTime
+            steps = 0
+            while accumulator >= sim_dt and steps < Constants.MAX_SIM_STEPS and self.running:
+                self.events, pending_events = pending_events, []
+                if self.recorder is not None:
+                    self.recorder.record_frame(sim_dt, self.mouse_pos, self.events)
+                self.advance(sim_dt)
+                accumulator -= sim_dt
+                steps += 1
+            if steps == Constants.MAX_SIM_STEPS:
+                accumulator = min(accumulator, sim_dt)
 
-            # Updates objects (adds new, delete old)
-            self.update_objects()
+            # Renders
+            changed_rects = self.draw(deltaTime, min(1.0, accumulator / sim_dt))
+
+            # The overlay is drawn over the whole frame, so the screen is redrawn fully while it is shown
+            if self.profiler.overlay:
+                self.profiler.render_overlay(self.screen)
+                self.renderer.full_redraw = True
+                changed_rects = None
 
             # Updates display
-            pygame.display.update()
+            if profiling:
+                start = time.perf_counter()
+            if changed_rects is None:
+                pygame.display.update()
+            else:
+                pygame.display.update(changed_rects)
+            if profiling:
+                self.profiler.add("display.update", time.perf_counter() - start)
+                self.profiler.end_frame()
 
             # sets fps to a variable. can be set to caption any time for testing.
             self.last_fps_show += 1
             if self.last_fps_show == 30:  # every 30th frame:
                 self.fps = self.clock.get_fps()
-                pygame.display.set_caption("CalPal v1.0" + "   FPS: " + str(self.fps))
+                pygame.display.set_caption("CalPal v1.0" + "   FPS: " + str(self.fps) + "   Drawn: " +
+                                           str(self.renderer.drawn) + "   Culled: " + str(self.renderer.culled))
                 self.last_fps_show = 0
 
-            # fps max 60
-            self.clock.tick(120)
+            self.clock.tick(Constants.MAX_FPS)
+
+        self.stop_recording()
+        self.disable_autosave()
+        self.disable_streaming(keep_on_disk=True)
+        self.disable_telemetry()
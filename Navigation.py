@@ -0,0 +1,205 @@
+import heapq
+import math
+
+
+class NavGrid:
+    """
+    Grid over the world marking the cells covered by collidable objects, for finding paths around them with A*.
+    Each cell counts the obstacles covering it so obstacles can be added, moved and removed independently. Found
+    paths are cached by start and goal cell until the grid changes
+    """
+    # Neighbour offsets and their cost. Diagonal moves may not cut the corner of a blocked cell
+    STRAIGHT = ((1, 0), (-1, 0), (0, 1), (0, -1))
+    DIAGONAL = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+    def __init__(self, cell_size, world_size, clearance=0, cache_size=4096):
+        """
+
+        :param cell_size: Side of a grid cell in pixels
+        :param world_size: (width, height) of the area covered by the grid
+        :param clearance: Distance in pixels paths keep from obstacles' physics rects
+        :param cache_size: Maximum number of cached paths
+        """
+        self.cell_size = cell_size
+        self.width = max(1, math.ceil(world_size[0] / cell_size))
+        self.height = max(1, math.ceil(world_size[1] / cell_size))
+        self.clearance = clearance
+
+        # Number of obstacles covering each cell, row by row
+        self.blocked = [0] * (self.width * self.height)
+        # Obstacle -> (x0, y0, x1, y1) cells it covers
+        self.obstacles = {}
+
+        # Incremented whenever a cell changes between free and blocked. Paths of older versions are stale
+        self.version = 0
+
+        # (start cell, goal cell) -> waypoints, or None if the goal can't be reached
+        self.cache = {}
+        self.cache_size = cache_size
+        self.cache_version = 0
+
+    def cell_of(self, pos):
+        return (min(self.width - 1, max(0, int(pos[0] // self.cell_size))),
+                min(self.height - 1, max(0, int(pos[1] // self.cell_size))))
+
+    def cell_center(self, cell):
+        return (cell[0] + 0.5) * self.cell_size, (cell[1] + 0.5) * self.cell_size
+
+    def is_blocked(self, cell):
+        return self.blocked[cell[1] * self.width + cell[0]] > 0
+
+    # Cells covered by an obstacle's physics rect grown by the clearance
+    def _cell_range(self, obj):
+        rect = obj.physics_rect.inflate(self.clearance * 2, self.clearance * 2)
+        x0, y0 = self.cell_of(rect.topleft)
+        x1, y1 = self.cell_of((rect.right - 1, rect.bottom - 1))
+        return x0, y0, x1, y1
+
+    def _mark(self, cell_range, amount):
+        x0, y0, x1, y1 = cell_range
+        blocked = self.blocked
+        changed = False
+        for y in range(y0, y1 + 1):
+            row = y * self.width
+            for i in range(row + x0, row + x1 + 1):
+                before = blocked[i]
+                blocked[i] = before + amount
+                changed = changed or (before == 0) != (blocked[i] == 0)
+        if changed:
+            self.version += 1
+
+    def block(self, obj):
+        if obj in self.obstacles:
+            return
+        cell_range = self.obstacles[obj] = self._cell_range(obj)
+        self._mark(cell_range, 1)
+
+    def unblock(self, obj):
+        cell_range = self.obstacles.pop(obj, None)
+        if cell_range is not None:
+            self._mark(cell_range, -1)
+
+    # Moves an obstacle's cells after it moved. Does nothing for objects that aren't obstacles
+    def update(self, obj):
+        cell_range = self.obstacles.get(obj)
+        if cell_range is None:
+            return
+        new_range = self._cell_range(obj)
+        if new_range != cell_range:
+            self.obstacles[obj] = new_range
+            self._mark(new_range, 1)
+            self._mark(cell_range, -1)
+
+    # Closest free cell to cell, searching outwards in rings. None if every cell is blocked
+    def nearest_free(self, cell):
+        if not self.is_blocked(cell):
+            return cell
+        cx, cy = cell
+        best = None
+        for ring in range(1, max(self.width, self.height)):
+            for x in range(cx - ring, cx + ring + 1):
+                edge = x == cx - ring or x == cx + ring
+                for y in (range(cy - ring, cy + ring + 1) if edge else (cy - ring, cy + ring)):
+                    if 0 <= x < self.width and 0 <= y < self.height and not self.is_blocked((x, y)):
+                        dist = (x - cx) ** 2 + (y - cy) ** 2
+                        if best is None or dist < best[0]:
+                            best = (dist, (x, y))
+            if best is not None:
+                return best[1]
+        return None
+
+    def find_path(self, start, goal):
+        """
+        Finds a path between two positions around the obstacles. A start or goal inside an obstacle is moved to the
+        closest free cell, the caller walks the remaining straight line itself
+
+        :return: Tuple of waypoint positions, excluding the start and ending at the center of the goal's cell, or
+            None if there is no path
+        """
+        if self.cache_version != self.version:
+            self.cache.clear()
+            self.cache_version = self.version
+
+        start_cell = self.nearest_free(self.cell_of(start))
+        goal_cell = self.nearest_free(self.cell_of(goal))
+        if start_cell is None or goal_cell is None:
+            return None
+
+        key = (start_cell, goal_cell)
+        if key in self.cache:
+            return self.cache[key]
+        cells = self.search(start_cell, goal_cell)
+        path = None if cells is None else tuple(self.cell_center(cell) for cell in self.smooth(cells)[1:])
+        if len(self.cache) >= self.cache_size:
+            del self.cache[next(iter(self.cache))]
+        self.cache[key] = path
+        return path
+
+    def search(self, start, goal):
+        """
+        A* over free cells with 8 neighbours and the octile distance as heuristic
+
+        :return: List of cells from start to goal, or None if goal can't be reached
+        """
+        width, height = self.width, self.height
+        blocked = self.blocked
+        gx, gy = goal
+
+        def heuristic(x, y):
+            dx, dy = abs(x - gx), abs(y - gy)
+            return dx + dy + (math.sqrt(2) - 2) * min(dx, dy)
+
+        costs = {start: 0}
+        parents = {start: None}
+        heap = [(heuristic(*start), 0, start)]
+        while heap:
+            _, cost, cell = heapq.heappop(heap)
+            if cell == goal:
+                path = []
+                while cell is not None:
+                    path.append(cell)
+                    cell = parents[cell]
+                return path[::-1]
+            if cost > costs[cell]:
+                continue
+
+            x, y = cell
+            for offsets, step in ((NavGrid.STRAIGHT, 1), (NavGrid.DIAGONAL, math.sqrt(2))):
+                for dx, dy in offsets:
+                    nx, ny = x + dx, y + dy
+                    if not (0 <= nx < width and 0 <= ny < height) or blocked[ny * width + nx]:
+                        continue
+                    if dx and dy and (blocked[y * width + nx] or blocked[ny * width + x]):
+                        continue
+                    new_cost = cost + step
+                    neighbour = (nx, ny)
+                    if new_cost < costs.get(neighbour, math.inf):
+                        costs[neighbour] = new_cost
+                        parents[neighbour] = cell
+                        heapq.heappush(heap, (new_cost + heuristic(nx, ny), new_cost, neighbour))
+        return None
+
+    # Whether the straight line between the centers of two cells only crosses free cells
+    def line_free(self, a, b):
+        steps = max(abs(b[0] - a[0]), abs(b[1] - a[1])) * 4
+        for i in range(1, steps):
+            t = i / steps
+            x, y = a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t
+            # Checks every cell the sample point touches so the line never clips a blocked corner
+            for cx in {math.floor(x + 0.499), math.ceil(x - 0.499)}:
+                for cy in {math.floor(y + 0.499), math.ceil(y - 0.499)}:
+                    if self.is_blocked((cx, cy)):
+                        return False
+        return True
+
+    # Drops the cells of a path that can be skipped by walking in a straight line
+    def smooth(self, cells):
+        smoothed = [cells[0]]
+        i = 0
+        while i < len(cells) - 1:
+            j = len(cells) - 1
+            while j > i + 1 and not self.line_free(cells[i], cells[j]):
+                j -= 1
+            smoothed.append(cells[j])
+            i = j
+        return smoothed
@@ -1,15 +1,134 @@
-import random
+import math
+
 import pygame
+import Components
+import Constants
 import Utils
 pygame.font.init()
 
 
+class TagSet(set):
+    """
+    Set of tags that reports every change to the manager owning its object, so the manager's tag index stays
+    correct when tags are added or removed after the object was queued
+    """
+    __slots__ = ("owner",)
+
+    def __init__(self, owner, tags=()):
+        super().__init__(tags)
+        self.owner = owner
+
+    # Forwards the difference between the old and the current contents to the manager
+    def _notify(self, before):
+        manager = self.owner.manager
+        if manager is None:
+            return
+        for tag in before - self:
+            manager.untag_object(self.owner, tag)
+        for tag in self - before:
+            manager.tag_object(self.owner, tag)
+
+    def add(self, tag):
+        if tag not in self:
+            super().add(tag)
+            if self.owner.manager is not None:
+                self.owner.manager.tag_object(self.owner, tag)
+
+    def discard(self, tag):
+        if tag in self:
+            super().discard(tag)
+            if self.owner.manager is not None:
+                self.owner.manager.untag_object(self.owner, tag)
+
+    def remove(self, tag):
+        if tag not in self:
+            raise KeyError(tag)
+        self.discard(tag)
+
+    def pop(self):
+        tag = next(iter(self))
+        self.discard(tag)
+        return tag
+
+    def clear(self):
+        before = set(self)
+        super().clear()
+        self._notify(before)
+
+    def update(self, *others):
+        before = set(self)
+        super().update(*others)
+        self._notify(before)
+
+    def difference_update(self, *others):
+        before = set(self)
+        super().difference_update(*others)
+        self._notify(before)
+
+    def intersection_update(self, *others):
+        before = set(self)
+        super().intersection_update(*others)
+        self._notify(before)
+
+    def symmetric_difference_update(self, other):
+        before = set(self)
+        super().symmetric_difference_update(other)
+        self._notify(before)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+
 class Object:
+    # Type specific (attribute, format) pairs saved in world snapshots. The format is a struct character, "2d" for
+    # a pair of floats, "s" for a string or "ref" for a reference to another object
+    SNAPSHOT_FIELDS = ()
+    # Whether dead objects of this type are kept for reuse by Manager.spawn
+    POOLED = False
+    # Whether the object is positioned on the screen instead of in the world, so the camera doesn't move it
+    SCREEN_SPACE = False
+    # Whether the object is written to disk with its chunk when no creature or the camera is near, see Chunks. Not
+    # for static or collidable objects
+    STREAMED = False
+
+    # Objects have no attribute dict, every attribute is declared in the __slots__ of its class
+    __slots__ = ("manager", "row", "tags", "sprite_surface", "image_rect", "center", "_previous_center",
+                 "telemetry_id", "physics_rect", "physics_rect_offset", "_lifetime", "_expire_tick", "_expiry_timer",
+                 "_kill", "_do_render", "dirty", "z_order", "_exist_time", "_birth_tick", "timers", "_sleeping",
+                 "generation")
+
     def __init__(self, lifetime, z_order, image, center_pos, tags=(), physics_rect=None, physics_rect_offset=(0, 0)):
+        # Manager this object has been added to, set by Manager.update_objects
+        self.manager = None
+
+        # Row of the object in the manager's component store while it is in one, see Components
+        self.row = None
+
+        # Set of string tags that can identify an object
+        self.tags = TagSet(self, tags)
+
         # Variables for rendering
         self.sprite_surface = image
         self.image_rect = self.sprite_surface.get_rect(center=center_pos)
         self.center = center_pos
+        # Center before the last simulation step, None if the object didn't move in it. See draw_offset
+        self._previous_center = None
+
+        # Number of the object in the telemetry log, given when it first appears in it
+        self.telemetry_id = None
 
         # Physics Descriptors
         self.physics_rect = physics_rect if physics_rect is not None else self.image_rect
@@ -17,12 +136,18 @@ class Object:
                                     center_pos[1] + physics_rect_offset[1])
         self.physics_rect_offset = physics_rect_offset
 
-        # Life determination
-        self.lifetime = lifetime
-        self.kill = False
+        # Life determination. While the object is in a manager, its lifetime and age are kept as the manager ticks
+        # they end and started at, see on_add
+        self._lifetime = lifetime
+        self._expire_tick = None
+        self._expiry_timer = None
+        self._kill = False
 
         # Render this object?
-        self.do_render = True
+        self._do_render = True
+
+        # Has the object's appearance changed without it moving? Cleared by the renderer once redrawn
+        self.dirty = True
 
         # Is this object solid (can it be walked through)
         self.is_collidable = False
@@ -31,16 +156,195 @@ class Object:
         self.z_order = z_order
 
         # Time the object has existed
-        self.exist_time = 0
+        self._exist_time = 0
+        self._birth_tick = 0
 
-        # Set of string tags that can identify an object
-        self.tags = set(tags)
+        # Scheduler entries of this object, cancelled when it leaves the manager
+        self.timers = []
+
+        # Sleeping objects are skipped by the manager's update loop. Objects without per-frame behaviour sleep and do
+        # their work from timers
+        self._sleeping = False
+
+        # Number of times the object was reused from a pool. References kept across frames can compare it to tell
+        # whether the object is still the one they referred to
+        self.generation = 0
+
+    # Collidable objects carry the "collidable" tag so they can be looked up through the manager's tag index
+    @property
+    def is_collidable(self):
+        return "collidable" in self.tags
+
+    @is_collidable.setter
+    def is_collidable(self, value):
+        if value:
+            self.tags.add("collidable")
+        else:
+            self.tags.discard("collidable")
+
+    # Static objects never move or animate their base image, so the renderer composites them into a cached layer
+    # once instead of drawing them every frame. They carry the "static" tag
+    @property
+    def is_static(self):
+        return "static" in self.tags
+
+    @is_static.setter
+    def is_static(self, value):
+        if value:
+            self.tags.add("static")
+        else:
+            self.tags.discard("static")
+
+    # Kept in the component store while the object is in a manager that has one
+    @property
+    def previous_center(self):
+        if self.row is None:
+            return self._previous_center
+        return self.manager.components.previous_center(self)
+
+    @previous_center.setter
+    def previous_center(self, value):
+        if self.row is None:
+            self._previous_center = value
+        elif value is None:
+            self.manager.components.set_flag(self, Components.INTERPOLATE, False)
+        else:
+            self.manager.components.previous[self.row] = value
+            self.manager.components.set_flag(self, Components.INTERPOLATE, True)
+
+    @property
+    def do_render(self):
+        return self._do_render
+
+    @do_render.setter
+    def do_render(self, value):
+        self._do_render = value
+        if self.row is not None:
+            self.manager.components.set_flag(self, Components.RENDER, value)
+
+    def reset(self, lifetime, center_pos, tags=()):
+        """
+        Brings a dead object back to the state of a new one at center_pos, reusing its rects and surfaces. Used by
+        the manager's object pools. The object must not be in a manager
+        """
+        self.tags.clear()
+        self.tags.update(tags)
+        self.center = center_pos
+        self.previous_center = None
+        self.image_rect.center = center_pos
+        self.physics_rect.center = (center_pos[0] + self.physics_rect_offset[0],
+                                    center_pos[1] + self.physics_rect_offset[1])
+        self._lifetime = lifetime
+        self._expire_tick = self._expiry_timer = None
+        self._kill = False
+        self._exist_time = 0
+        self.timers = []
+        self.do_render = True
+        self.dirty = True
+        self.telemetry_id = None
+        self.generation += 1
+        self.init_state()
+
+    # Sets the type specific state a new object starts with. Called by the constructor of types that are pooled
+    # and again whenever such an object is reused
+    def init_state(self):
+        pass
+
+    # Frames the object has existed for
+    @property
+    def exist_time(self):
+        if self.manager is None:
+            return self._exist_time
+        return self.manager.tick - self._birth_tick
+
+    @exist_time.setter
+    def exist_time(self, value):
+        if self.manager is None:
+            self._exist_time = value
+        else:
+            self._birth_tick = self.manager.tick - value
+
+    # Frames left until the object dies, None if it lives forever
+    @property
+    def lifetime(self):
+        if self.manager is None or self._expire_tick is None:
+            return self._lifetime
+        return self._expire_tick - self.manager.tick
+
+    @lifetime.setter
+    def lifetime(self, value):
+        self._lifetime = value
+        if self.manager is not None:
+            self.schedule_expiry()
+
+    # Setting kill queues the object for removal at the end of the frame
+    @property
+    def kill(self):
+        return self._kill
+
+    @kill.setter
+    def kill(self, value):
+        if value and not self._kill and self.manager is not None:
+            self.manager.game_object_delete_queue.append(self)
+        self._kill = value
+
+    @property
+    def sleeping(self):
+        return self._sleeping
+
+    @sleeping.setter
+    def sleeping(self, value):
+        self._sleeping = value
+        if self.manager is not None:
+            self.manager.set_sleeping(self, value)
+
+    # Called by the manager once the object is in the world. Subclasses schedule their timers here
+    def on_add(self, manager):
+        self._birth_tick = manager.tick - self._exist_time
+        self.schedule_expiry()
+        if self._kill:
+            manager.game_object_delete_queue.append(self)
+
+    # Called by the manager before the object leaves the world. Pending timers are cancelled
+    def on_remove(self, manager):
+        self._exist_time = self.exist_time
+        self._lifetime = self.lifetime
+        self._expire_tick = self._expiry_timer = None
+        for timer in self.timers:
+            manager.scheduler.cancel(timer)
+        self.timers = []
+
+    def schedule(self, delay, callback, *args):
+        """
+        Calls callback(*args) in delay ticks, unless the object leaves the manager first. Only valid while the
+        object is in a manager
+
+        :param delay: Ticks from now. The callback runs at the end of the frame the manager reaches that tick in
+        :return: Scheduler entry, can be passed to manager.scheduler.cancel()
+        """
+        scheduler = self.manager.scheduler
+        self.timers = [timer for timer in self.timers if scheduler.pending(timer)]
+        timer = scheduler.schedule(self.manager.tick + delay, callback, *args)
+        self.timers.append(timer)
+        return timer
+
+    # (Re)schedules the object's death for when its lifetime runs out
+    def schedule_expiry(self):
+        if self._expiry_timer is not None:
+            self.manager.scheduler.cancel(self._expiry_timer)
+        self._expire_tick = self._expiry_timer = None
+        if self._lifetime is not None:
+            self._expire_tick = self.manager.tick + self._lifetime
+            self._expiry_timer = self.schedule(self._lifetime, self.expire)
+
+    def expire(self):
+        self.kill = True
 
     @staticmethod
     def rotate(image, rect, angle):
-        """Rotate the image while keeping its center."""
-        # Rotate the original image without modifying it.
-        new_image = pygame.transform.rotate(image, angle)
+        """Rotate the image while keeping its center. The angle is rounded to Constants.ROTATION_STEP degrees."""
+        # Rotate the original image without modifying it. The rotated image comes from the shared cache
+        new_image = Utils.rotate_image(image, angle)
         # Get a new rect with the center of the old rect.
         rect = new_image.get_rect(center=rect.center)
         return new_image, rect
@@ -57,6 +361,12 @@ class Object:
         self.physics_rect.center = (self.center[0] + self.physics_rect_offset[0],
                                     self.center[1] + self.physics_rect_offset[1])
         self.image_rect.center = self.center
+        if self.manager is not None:
+            self.manager.spatial.update(self)
+            if self.manager.navigation is not None:
+                self.manager.navigation.update(self)
+            if self.row is not None:
+                self.manager.components.mark_moved(self)
 
     def pre_update(self, manager, time_delta):
         pass
@@ -64,9 +374,36 @@ class Object:
     def post_update(self, manager, time_delta):
         pass
 
-    def render(self, surface, time_delta):
+    # Called after a snapshot restored the object's fields
+    def on_restore(self):
+        pass
+
+    # Draws the object. offset is added to world positions to get screen positions, see Renderer.Camera
+    def render(self, surface, time_delta, offset):
+        pass
+
+    # Draws the unchanging part of a static object onto the cached static layer
+    def render_static(self, surface, offset=(0, 0)):
+        surface.blit(self.sprite_surface, self.image_rect.move(offset))
+
+    # Draws the animated part of a static object on top of the static layer each frame
+    def render_overlay(self, surface, time_delta, offset):
         pass
 
+    # Offset from the object's position to where it is drawn alpha of a simulation step after its last step, in
+    # between its positions before and after that step
+    def draw_offset(self, alpha):
+        previous = self.previous_center
+        if previous is None:
+            return 0, 0
+        return (int(round((previous[0] - self.center[0]) * (1 - alpha))),
+                int(round((previous[1] - self.center[1]) * (1 - alpha))))
+
+    # World area covered by render(), or screen area for screen space objects. Used for culling and by the dirty
+    # rectangle renderer
+    def get_render_rect(self):
+        return self.image_rect
+
 
 
 
@@ -76,6 +413,10 @@ class Object:
 
 
 class GUI(Object):
+    SNAPSHOT_FIELDS = (("calories", "i"),)
+    SCREEN_SPACE = True
+    __slots__ = ("calories", "font", "text_color", "text_pos", "text", "text_surface", "text_rect")
+
     def __init__(self, lifetime, z_order, pos, tags=()):
         super().__init__(lifetime, z_order, pygame.Surface(Utils.cscale(600, 500)), pos, tags)
 
@@ -84,24 +425,53 @@ class GUI(Object):
         self.calories = 2000
 
         self.font = pygame.font.SysFont("Arial", Utils.cscale(30))
+        self.text_color = (200, 0, 0)
+        self.text_pos = Utils.cscale(100, 50)
+        self.text_surface = None
+        self.text_rect = None
+        self.update_text()
+
+    # Fetches the counter text after the calories changed
+    def update_text(self):
+        self.text = "Calories " + str(self.calories)
+        self.text_surface = Utils.text_cache.render(self.font, self.text, True, self.text_color)
+        self.text_rect = self.text_surface.get_rect(topleft=self.text_pos)
+        self.dirty = True
 
     def pre_update(self, manager, time_delta):
         for event in manager.events:
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_1 and self.calories >= 100:
-                    manager.add_object(Grass(None, pygame.mouse.get_pos()))
-                    self.calories -= 100
+                    self.buy(manager, Grass, 100)
                 elif event.key == pygame.K_2 and self.calories >= 200:
-                    manager.add_object(Kibble(None, pygame.mouse.get_pos()))
-                    self.calories -= 200
+                    self.buy(manager, Kibble, 200)
                 elif event.key == pygame.K_3 and self.calories >= 300:
-                    manager.add_object(Snack(None, pygame.mouse.get_pos()))
-                    self.calories -= 300
+                    self.buy(manager, Snack, 300)
                 if event.key == pygame.K_e and self.calories >= 10:
-                    self.calories -= 10
+                    self.spend(manager, 10)
+                if self.text != "Calories " + str(self.calories):
+                    self.update_text()
+
+    # Places food of type cls at the mouse
+    def buy(self, manager, cls, price):
+        food = manager.spawn(cls, None, manager.world_mouse_pos)
+        self.spend(manager, price)
+        if manager.telemetry is not None:
+            manager.telemetry.food_spawned(food)
+
+    def spend(self, manager, amount):
+        self.calories -= amount
+        if manager.telemetry is not None:
+            manager.telemetry.calories_spent(self, amount)
+
+    def on_restore(self):
+        self.update_text()
+
+    def render(self, surface, time_delta, offset):
+        surface.blit(self.text_surface, self.text_pos)
 
-    def render(self, surface, time_delta):
-        surface.blit(self.font.render("Calories " + str(self.calories), True, (200, 0, 0)), Utils.cscale(100, 50))
+    def get_render_rect(self):
+        return self.text_rect
 
 
 
@@ -114,22 +484,39 @@ class GUI(Object):
 class Creature(Object):
     MAXSPEED = 1
     MAXFORCE = 0.25
+    IMAGE_PATH = "assets/images/Buster_Happy.png"
+    IMAGE_SIZE = (200, 150)
+    AVOID_RADIUS = 200
+    SNAPSHOT_FIELDS = (("vel", "2d"), ("happiness", "d"), ("hunger", "d"), ("thirst", "d"), ("moving", "?"),
+                       ("food", "ref"), ("facing_right", "?"))
+    # Distance at which a navigation waypoint counts as reached
+    WAYPOINT_RADIUS = 20
+    # Number of closest food items the creature randomly picks between
+    FOOD_CHOICES = 3
+    # Range the hunger and thirst levels at which the creature goes to eat or drink are randomly picked from
+    HUNGER_THRESHOLD = (25, 50)
+    THIRST_THRESHOLD = (25, 50)
+    # The creature also eats (drinks) once its thirst (hunger) is this many times its hunger (thirst)
+    CRAVING_RATIO = 2
+    __slots__ = ("sprite_surface_right", "pos", "vel", "acc", "happiness", "hunger", "thirst", "moving", "food",
+                 "food_generation", "facing_right", "path", "path_target", "path_version", "meals", "drinks")
 
     def __init__(self, lifetime, pos, tags=()):
-        super().__init__(lifetime, 5, Utils.load_image("assets/images/Buster_Happy.png", (200, 150)), pos, tags)
+        super().__init__(lifetime, 5, Utils.load_image(Creature.IMAGE_PATH, Creature.IMAGE_SIZE), pos, tags)
 
         self.tags.add("creature")
         """self.skeleton = Skeleton.Skeleton((
-            Skeleton.Bone(start_node_pos=(-100, 100),
+            Skeleton.Bone(None, (0, 0), 0,
+                          start_node_pos=(-100, 100),
                           end_node_pos=(100, 0)),
-            Skeleton.Bone(start_node_pos=(0, 0),
+            Skeleton.Bone(None, (0, 0), 1,
+                          start_node_pos=(0, 0),
                           end_node_pos=(150, 0)),
         ))
-        self.skeleton.bones[0].add_connection(Skeleton.Bone.NodeTypes.END_NODE,
-                                              self.skeleton.bones[1],
-                                              Skeleton.Bone.NodeTypes.START_NODE)
+        self.skeleton.connect(0, Skeleton.Bone.NodeTypes.END_NODE,
+                              1, Skeleton.Bone.NodeTypes.START_NODE)
         """
-        self.sprite_surface_right = pygame.transform.flip(self.sprite_surface, True, False).convert_alpha()
+        self.sprite_surface_right = Utils.load_image(Creature.IMAGE_PATH, Creature.IMAGE_SIZE, flip=(True, False))
 
         self.pos = self.center
         self.vel = [0, 0]
@@ -139,42 +526,107 @@ class Creature(Object):
         self.thirst = 100
         self.moving = False
         self.food = None
+        self.food_generation = 0  # Generation of food when it was picked, see food_gone
+        self.facing_right = True
+
+        # Remaining navigation waypoints to the target they were found for, at the navigation grid version
+        self.path = None
+        self.path_target = None
+        self.path_version = None
+
+        # Meals eaten and sips drunk, one sip per frame spent at the pond. Only used for reporting
+        self.meals = 0
+        self.drinks = 0
+
+    @property
+    def dead(self):
+        return self.hunger <= 0 or self.thirst <= 0
+
+    # Steers towards target in sub-steps of at most Constants.STEERING_STEP, stopping once it arrived
+    def go_to(self, manager, target, time_delta, arrive=True):
+        steps = Creature.steering_steps(time_delta)
+        time_delta /= steps
+        for _ in range(steps):
+            self.applyForce(self.seek(target, arrive))
+            if self.avoids_obstacles(manager):
+                for obstacle in manager.spatial.query_radius(self.pos, Creature.AVOID_RADIUS, tag="collidable"):
+                    self.applyForce(self.avoid(obstacle.center))
+            self.vel[0] += self.acc[0] * time_delta * 100
+            self.vel[1] += self.acc[1] * time_delta * 100
+            self.pos[0] += self.vel[0] * time_delta * 100
+            self.pos[1] += self.vel[1] * time_delta * 100
+            self.acc = [0, 0]
+            if not self.moving:
+                break
+
+    # Number of sub-steps a step of time_delta seconds is steered in
+    @staticmethod
+    def steering_steps(time_delta):
+        return max(1, math.ceil(time_delta / Constants.STEERING_STEP - 1e-9))
 
-    def go_to(self, manager, target, time_delta):
-        self.applyForce(self.seek(target))
-        obstacles = [obj for obj in manager.game_objects if obj.is_collidable]
-        if "pond" in self.food.tags:
-            obstacles = [obj for obj in obstacles if "pond" not in self.food.tags]
-        for obstacle in obstacles:
-            self.applyForce(self.avoid(obstacle.center))
-        self.vel[0] += self.acc[0] * time_delta * 100
-        self.vel[1] += self.acc[1] * time_delta * 100
-        self.pos[0] += self.vel[0] * time_delta * 100
-        self.pos[1] += self.vel[1] * time_delta * 100
-        self.acc = [0, 0]
-
-    def seek(self, target):
+    # Force towards target. Slows down and stops at the target if arrive is set, otherwise passes it at full speed
+    def seek(self, target, arrive=True):
         desired = (target[0] - self.pos[0], target[1] - self.pos[1])
         dist = (desired[0] ** 2 + desired[1] ** 2) ** (1 / 2)
         speed = Creature.MAXSPEED
-        if dist < 100:
+        if dist < 100 and arrive:
             speed = dist / 100
         desired = (desired[0] * speed / dist, desired[1] * speed / dist)
         steer = (desired[0] - self.vel[0], desired[1] - self.vel[1])
         mag = (steer[0] ** 2 + steer[1] ** 2) ** (1 / 2)
         if mag > Creature.MAXFORCE:
             steer = (steer[0] * Creature.MAXFORCE / mag, desired[1] * Creature.MAXFORCE / mag)
-        if dist < 10:
+        if dist < 10 and arrive:
             self.moving = False
             self.vel = [0, 0]
             return 0, 0
         else:
             return steer
 
+    # Whether the food the creature is heading for was eaten, or has since been reused for a new food item
+    def food_gone(self):
+        food = self.food
+        return food.kill or food.manager is None or food.generation != self.food_generation
+
+    # A creature whose food wasn't saved with it (e.g. it was eaten the step before) stops heading for it
+    def on_restore(self):
+        self.food_generation = self.food.generation if self.food is not None else 0
+        self.path = None
+        if self.food is None:
+            self.moving = False
+
+    # Creatures following a navigation path don't need pushing away from obstacles, those navigation found no path
+    # for do. Creatures heading into the pond never do
+    def avoids_obstacles(self, manager):
+        return (manager.navigation is None or self.path is None) and "pond" not in self.food.tags
+
+    def next_waypoint(self, manager, target):
+        """
+        Point to walk to next on the way to target. Finds a new path when the target or the obstacles changed.
+        Without a path the creature heads straight for target and the path is looked for again every step, which the
+        navigation grid answers from its cache until the creature reaches another cell
+
+        :return: (waypoint, whether it is the target itself)
+        """
+        navigation = manager.navigation
+        if navigation is None:
+            return target, True
+        if self.path is None or self.path_target != tuple(target) or self.path_version != navigation.version:
+            path = navigation.find_path(self.pos, target)
+            self.path = list(path) if path is not None else None
+            self.path_target = tuple(target)
+            self.path_version = navigation.version
+
+        while self.path and Utils.distance(self.pos, self.path[0]) < Creature.WAYPOINT_RADIUS:
+            self.path.pop(0)
+        if self.path:
+            return self.path[0], False
+        return target, True
+
     def avoid(self, obstacle):
         desired = (obstacle[0] - self.pos[0], obstacle[1] - self.pos[1])
         dist = (desired[0] ** 2 + desired[1] ** 2) ** (1 / 2)
-        if dist < 200:
+        if dist < Creature.AVOID_RADIUS:
             desired = (-desired[0] * Creature.MAXSPEED / dist, -desired[1] * Creature.MAXSPEED / dist)
             steer = (desired[0] - self.vel[0], desired[1] - self.vel[1])
             # mag = (steer[0] ** 2 + steer[1] ** 2) ** (1 / 2)
@@ -192,40 +644,66 @@ class Creature(Object):
 
     def pre_update(self, manager, time_delta):
         if not self.moving:
-            if random.randint(0, 1) == 0:
-                self.hunger -= time_delta * random.randint(1, 10)
+            if manager.rng.randint(0, 1) == 0:
+                self.hunger -= time_delta * manager.rng.randint(1, 10)
             else:
-                self.thirst -= time_delta * random.randint(1, 10)
-        print(self.hunger, self.thirst)
-        if self.hunger <= 0 or self.thirst <= 0:
+                self.thirst -= time_delta * manager.rng.randint(1, 10)
+        if manager.telemetry is not None:
+            manager.telemetry.creature_stats(self)
+        if self.dead:
             # Die
             return
+        if self.food is not None and self.food_gone():
+            # Something else ate it first
+            self.moving = False
+            self.food = None
         if self.moving:
-            self.go_to(manager, self.food.center, time_delta)
+            target, arrive = self.next_waypoint(manager, self.food.center)
+            if manager.steering is not None:
+                manager.steering.request(self, target, arrive, self.avoids_obstacles(manager))
+            else:
+                self.go_to(manager, target, time_delta, arrive)
         else:
             if self.food is not None:
                 if "pond" in self.food.tags:
                     self.update_thirst(100)
+                    self.drinks += 1
                 else:
                     self.update_hunger(self.food.calories)
+                    self.meals += 1
+                    if manager.telemetry is not None:
+                        manager.telemetry.food_eaten(self, self.food)
                     self.food.kill = True
                     self.food = None
-            if self.thirst / self.hunger > 2 or self.hunger <= random.randint(25, 50):
-                self.food = random.choice([obj for obj in manager.game_objects if "food" in obj.tags])
-                self.moving = True
-            if self.hunger / self.thirst > 2 or self.thirst <= random.randint(25, 50):
-                self.food = [obj for obj in manager.game_objects if "pond" in obj.tags][0]
+            if self.thirst / self.hunger > Creature.CRAVING_RATIO or \
+                    self.hunger <= manager.rng.randint(*Creature.HUNGER_THRESHOLD):
+                nearby_food = manager.spatial.query_nearest(self.pos, Creature.FOOD_CHOICES, tag="food")
+                if nearby_food:
+                    self.food = manager.rng.choice(nearby_food)
+                    self.food_generation = self.food.generation
+                    self.moving = True
+                    self.path = None
+            if self.hunger / self.thirst > Creature.CRAVING_RATIO or \
+                    self.thirst <= manager.rng.randint(*Creature.THIRST_THRESHOLD):
+                self.food = next(iter(manager.by_tag("pond")))
+                self.food_generation = self.food.generation
                 self.moving = True
+                self.path = None
 
     def post_update(self, manager, time_delta):
-        pass
-
-    def render(self, surface, time_delta):
-        # self.skeleton.render(surface, time_delta, self.center)
+        # Faces the direction it is walking in
+        facing_right = self.vel[0] >= 0
+        if facing_right != self.facing_right:
+            self.facing_right = facing_right
+            self.dirty = True
+
+    def render(self, surface, time_delta, offset):
+        # self.skeleton.render(surface, time_delta, self.image_rect.move(offset).center, debug=True)
         # pygame.draw.circle(surface, (255, 200, 0), self.center, 5)
 
         #pygame.draw.rect(surface, (255, 0, 0), self.physics_rect, 1)
-        surface.blit(self.sprite_surface if self.vel[0] < 0 else self.sprite_surface_right, self.image_rect)
+        surface.blit(self.sprite_surface_right if self.facing_right else self.sprite_surface,
+                     self.image_rect.move(offset))
 
     def update_hunger(self, hunger):
         self.hunger = min(max(self.hunger + hunger ** (1 / 2), 0), 100)
@@ -242,23 +720,32 @@ class Creature(Object):
 
 
 class Grass(Object):
-    SEED2SPROUT_TIME = 3600
-    SPROUT2GRASS_TIME = 15000
-    SEED2SPROUT_TIME = 100
-    SPROUT2GRASS_TIME = 200
+    # Ages in ticks grass sprouts and grows fully at, written in seconds
+    SEED2SPROUT_TIME = 30 * Constants.SIM_RATE
+    SPROUT2GRASS_TIME = 125 * Constants.SIM_RATE
+    SEED2SPROUT_TIME = round(5 / 6 * Constants.SIM_RATE)
+    SPROUT2GRASS_TIME = round(5 / 3 * Constants.SIM_RATE)
 
     STAGES = {0: "seed", 1: "sprout", 2: "grass"}
     STAGE2IDX = {"seed": 0, "sprout": 1, "grass": 2}
     STAGE2CAL = {STAGES[0]: 10, STAGES[1]: 100, STAGES[2]: 250}
+    SNAPSHOT_FIELDS = (("stage", "s"), ("calories", "i"))
+    POOLED = True
+    STREAMED = True
+    __slots__ = ("stage", "calories", "happiness_index")
 
     def __init__(self, lifetime, pos, tags=()):
-        super().__init__(lifetime, 1, pygame.Surface(Utils.cscale(70, 45)), pos, tags)
+        # Grass has 3 stages of grass. The images come from the shared cache, so spawning grass never touches disk
+        stage_images = [Utils.load_image("assets/images/grass_0.png", Utils.cscale(70, 45)),
+                        Utils.load_image("assets/images/grass_1.png", Utils.cscale(70, 45)),
+                        Utils.load_image("assets/images/grass_2.png", Utils.cscale(70, 45))]
+        super().__init__(lifetime, 1, stage_images[0], pos, tags)
+        self.sprite_surface = stage_images
 
-        # Grass has 3 stages of grass
-        self.sprite_surface = [Utils.load_image("assets/images/grass_0.png", Utils.cscale(70, 45)),
-                               Utils.load_image("assets/images/grass_1.png", Utils.cscale(70, 45)),
-                               Utils.load_image("assets/images/grass_2.png", Utils.cscale(70, 45))]
+        self.sleeping = True
+        self.init_state()
 
+    def init_state(self):
         self.tags.add("grass")
         self.tags.add("food")
 
@@ -269,20 +756,32 @@ class Grass(Object):
         self.calories = self.STAGE2CAL[self.stage]
         self.happiness_index = 5  # Scale that goes from 0-100, where 100 is the most enjoyable food
 
+    def on_add(self, manager):
+        super().on_add(manager)
+        self.schedule_growth()
+
+    # Schedules the next growth stage for the age it is reached at
+    def schedule_growth(self):
+        if self.stage == Grass.STAGES[0]:
+            self.schedule(Grass.SEED2SPROUT_TIME - self.exist_time, self.grow)
+        elif self.stage == Grass.STAGES[1]:
+            self.schedule(Grass.SPROUT2GRASS_TIME - self.exist_time, self.grow)
+
+    # Updates grass growth stages and calories
+    def grow(self):
+        self.stage = Grass.STAGES[Grass.STAGE2IDX[self.stage] + 1]
+        self.calories = self.STAGE2CAL[self.stage]
+        self.dirty = True
+        self.schedule_growth()
+
     def pre_update(self, manager, time_delta):
-        # Updates grass growth stages and calories
-        if self.exist_time >= Grass.SEED2SPROUT_TIME and self.stage == Grass.STAGES[0]:
-            self.stage = Grass.STAGES[1]
-            self.calories = self.STAGE2CAL[self.stage]
-        if self.exist_time >= Grass.SPROUT2GRASS_TIME and self.stage == Grass.STAGES[1]:
-            self.stage = Grass.STAGES[2]
-            self.calories = self.STAGE2CAL[self.stage]
+        pass
 
     def post_update(self, manager, time_delta):
         pass
 
-    def render(self, surface, time_delta):
-        surface.blit(self.sprite_surface[Grass.STAGE2IDX[self.stage]], self.image_rect)
+    def render(self, surface, time_delta, offset):
+        surface.blit(self.sprite_surface[Grass.STAGE2IDX[self.stage]], self.image_rect.move(offset))
         #pygame.draw.rect(surface, (255, 0, 0), self.physics_rect, 1)
 
 
@@ -294,9 +793,18 @@ class Grass(Object):
 
 
 class Kibble(Object):
+    SNAPSHOT_FIELDS = (("calories", "i"),)
+    POOLED = True
+    STREAMED = True
+    __slots__ = ("calories", "happiness_index")
+
     def __init__(self, lifetime, pos, tags=()):
         super().__init__(lifetime, 2, Utils.load_image("assets/images/kibble.png", Utils.cscale(57, 30)), pos, tags)
 
+        self.sleeping = True
+        self.init_state()
+
+    def init_state(self):
         self.tags.add("kibble")
         self.tags.add("food")
 
@@ -310,15 +818,24 @@ class Kibble(Object):
     def post_update(self, manager, time_delta):
         pass
 
-    def render(self, surface, time_delta):
-        surface.blit(self.sprite_surface, self.image_rect)
+    def render(self, surface, time_delta, offset):
+        surface.blit(self.sprite_surface, self.image_rect.move(offset))
         #pygame.draw.rect(surface, (255, 0, 0), self.physics_rect, 1)
 
 
 class Snack(Object):
+    SNAPSHOT_FIELDS = (("calories", "i"),)
+    POOLED = True
+    STREAMED = True
+    __slots__ = ("calories", "happiness_index")
+
     def __init__(self, lifetime, pos, tags=()):
         super().__init__(lifetime, 3, Utils.load_image("assets/images/bone.png", Utils.cscale(65, 30)), pos, tags)
 
+        self.sleeping = True
+        self.init_state()
+
+    def init_state(self):
         self.tags.add("snack")
         self.tags.add("food")
 
@@ -332,8 +849,8 @@ class Snack(Object):
     def post_update(self, manager, time_delta):
         pass
 
-    def render(self, surface, time_delta):
-        surface.blit(self.sprite_surface, self.image_rect)
+    def render(self, surface, time_delta, offset):
+        surface.blit(self.sprite_surface, self.image_rect.move(offset))
         #pygame.draw.rect(surface, (255, 0, 0), self.physics_rect, 1)
 
 
@@ -345,11 +862,15 @@ class Snack(Object):
 
 
 class Shack(Object):
+    __slots__ = ()
+
     def __init__(self, lifetime, pos, tags=()):
         super().__init__(lifetime, 0, Utils.load_image("assets/images/shack.png", Utils.cscale(250, 250)), pos, tags)
 
         self.tags.add("shack")
+        self.sleeping = True
         self.is_collidable = True
+        self.is_static = True
 
     def pre_update(self, manager, time_delta):
         pass
@@ -357,8 +878,8 @@ class Shack(Object):
     def post_update(self, manager, time_delta):
         pass
 
-    def render(self, surface, time_delta):
-        surface.blit(self.sprite_surface, self.image_rect)
+    def render(self, surface, time_delta, offset):
+        surface.blit(self.sprite_surface, self.image_rect.move(offset))
         #pygame.draw.rect(surface, (255, 0, 0), self.physics_rect, 1)
 
 
@@ -369,11 +890,12 @@ class Shack(Object):
 
 
 class Pond(Object):
-    ANIMATION_SPEED = 50
+    # Ticks between ripple frames, written in seconds
+    ANIMATION_SPEED = max(1, round(5 / 12 * Constants.SIM_RATE))
+    SNAPSHOT_FIELDS = (("ripple_idx", "B"),)
+    __slots__ = ("ripple_images", "ripple_idx")
 
     def __init__(self, lifetime, pos, tags=()):
-        surf = pygame.Surface(Utils.cscale(200, 150))
-        surf.fill((20, 130, 200))
         super().__init__(lifetime, -1, Utils.load_image("assets/images/pond.png", Utils.cscale(260, 150)), pos, tags)
 
         self.ripple_images = [Utils.load_image("assets/images/ripples_1.png", Utils.cscale(260, 150)),
@@ -381,7 +903,9 @@ class Pond(Object):
         self.ripple_idx = 0
 
         self.tags.add("pond")
+        self.sleeping = True
         self.is_collidable = True
+        self.is_static = True
 
     def pre_update(self, manager, time_delta):
         pass
@@ -389,12 +913,21 @@ class Pond(Object):
     def post_update(self, manager, time_delta):
         pass
 
-    def render(self, surface, time_delta):
-        surface.blit(self.sprite_surface, self.image_rect)
-        surface.blit(self.ripple_images[self.ripple_idx], self.image_rect)
+    def on_add(self, manager):
+        super().on_add(manager)
+        self.schedule(Pond.ANIMATION_SPEED - self.exist_time % Pond.ANIMATION_SPEED, self.ripple)
+
+    # Runs animation
+    def ripple(self):
+        self.ripple_idx = 0 if self.ripple_idx == 1 else 1
+        self.dirty = True
+        self.schedule(Pond.ANIMATION_SPEED, self.ripple)
+
+    def render(self, surface, time_delta, offset):
+        self.render_static(surface, offset)
+        self.render_overlay(surface, time_delta, offset)
 
-        # Runs animation
-        if self.exist_time % Pond.ANIMATION_SPEED == 0:
-            self.ripple_idx = 0 if self.ripple_idx == 1 else 1
+    def render_overlay(self, surface, time_delta, offset):
+        surface.blit(self.ripple_images[self.ripple_idx], self.image_rect.move(offset))
 
         #pygame.draw.rect(surface, (255, 0, 0), self.physics_rect, 1)
@@ -0,0 +1,139 @@
+import time
+
+import numpy as np
+import pygame
+
+import Constants
+import Utils
+
+
+class FrameProfiler:
+    """
+    Times each phase of the game loop and keeps the last frames in a fixed-size ring buffer. Phases are plain
+    names, registered the first time they are timed. Nothing calls into the profiler while it is disabled
+    """
+    def __init__(self, capacity=Constants.PROFILER_FRAMES, max_phases=64):
+        self.enabled = False
+        self.overlay = False
+        self.capacity = capacity
+        self.max_phases = max_phases
+
+        # Phase name -> column of the ring buffer
+        self.columns = {}
+        self.names = []
+        # (kind, object class) -> column, saves building the phase name for every object
+        self.class_columns = {}
+
+        # Ring buffer of per-phase and whole-frame times in seconds
+        self.samples = np.zeros((capacity, max_phases))
+        self.frame_times = np.zeros(capacity)
+        self.frames = 0  # Frames recorded so far, the next one goes to row frames % capacity
+
+        # Phase times of the frame being recorded
+        self.current = [0.0] * max_phases
+        self.frame_start = 0
+
+        self.font = None
+
+    def column(self, name):
+        column = self.columns.get(name)
+        if column is None:
+            if len(self.names) == self.max_phases:
+                raise ValueError("Profiler can't track more than {} phases".format(self.max_phases))
+            column = self.columns[name] = len(self.names)
+            self.names.append(name)
+        return column
+
+    def class_column(self, kind, cls):
+        column = self.class_columns.get((kind, cls))
+        if column is None:
+            column = self.class_columns[(kind, cls)] = self.column(kind + " " + cls.__name__)
+        return column
+
+    def begin_frame(self):
+        self.current = [0.0] * self.max_phases
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        row = self.frames % self.capacity
+        self.samples[row] = self.current
+        self.frame_times[row] = time.perf_counter() - self.frame_start
+        self.frames += 1
+
+    def add(self, name, seconds):
+        self.current[self.column(name)] += seconds
+
+    def add_class(self, kind, cls, seconds):
+        self.current[self.class_column(kind, cls)] += seconds
+
+    # Runs Object.run_sprite, timing it under the object's class
+    def run_sprite(self, obj, manager, time_delta):
+        start = time.perf_counter()
+        obj.run_sprite(manager, time_delta)
+        self.current[self.class_column("run_sprite", type(obj))] += time.perf_counter() - start
+
+    def history(self, frames=None):
+        """
+        Returns the recorded phase times and frame times of the last frames, oldest first
+
+        :param frames: Number of frames to return, all frames in the buffer if None
+        :return: (phase names, array of shape (frames, phases), array of frame times) in seconds
+        """
+        count = min(self.frames, self.capacity)
+        if frames is not None:
+            count = min(count, frames)
+        rows = np.arange(self.frames - count, self.frames) % self.capacity
+        return list(self.names), self.samples[rows, :len(self.names)], self.frame_times[rows]
+
+    # Mean time of each phase in milliseconds over the last frames, slowest first
+    def averages(self, frames=None):
+        names, samples, _ = self.history(frames)
+        if not len(samples):
+            return []
+        means = samples.mean(axis=0) * 1000
+        return sorted(zip(names, means.tolist()), key=lambda i: -i[1])
+
+    # Writes the buffer to a CSV file with one row per frame and one column per phase, in milliseconds
+    def dump(self, path):
+        names, samples, frame_times = self.history()
+        first_frame = self.frames - len(frame_times)
+        with open(path, "w") as f:
+            f.write(",".join(["frame", "frame_ms"] + ['"' + name + '"' for name in names]) + "\n")
+            for i, (row, frame_time) in enumerate(zip(samples, frame_times)):
+                f.write(",".join([str(first_frame + i), "{:.4f}".format(frame_time * 1000)] +
+                                 ["{:.4f}".format(value * 1000) for value in row]) + "\n")
+
+    def render_overlay(self, surface):
+        if self.font is None:
+            self.font = pygame.font.SysFont("Arial", Utils.cscale(14))
+
+        graph_frames = Constants.PROFILER_GRAPH_FRAMES
+        names, samples, frame_times = self.history(graph_frames)
+        width, height = Utils.cscale(360, 230)
+        graph_height = Utils.cscale(90)
+        panel = pygame.Surface((width, height), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+
+        # Frame time graph, with lines at 120 and 30 FPS. Bars are scaled so 50ms fills the graph
+        scale = graph_height / 0.05
+        bar_width = width / graph_frames
+        for fps, color in ((120, (0, 160, 0)), (30, (160, 0, 0))):
+            y = graph_height - int(scale / fps)
+            pygame.draw.line(panel, color, (0, y), (width, y))
+        for i, frame_time in enumerate(frame_times.tolist()):
+            bar = min(graph_height, int(frame_time * scale))
+            pygame.draw.rect(panel, (230, 200, 60), (int(i * bar_width), graph_height - bar,
+                                                     max(1, int(bar_width)), bar))
+
+        # Slowest phases
+        lines = ["frame {:.2f} ms".format(frame_times.mean() * 1000 if len(frame_times) else 0)]
+        lines += ["{} {:.3f} ms".format(name, mean) for name, mean in self.averages(graph_frames)[:8]]
+        # The times change every frame, so the lines are rendered directly. Going through the shared text cache
+        # would only evict the strings cached for the HUD
+        y = graph_height + Utils.cscale(4)
+        for line in lines:
+            text = self.font.render(line, True, (255, 255, 255))
+            panel.blit(text, (Utils.cscale(6), y))
+            y += text.get_height()
+
+        surface.blit(panel, (0, surface.get_height() - height))
@@ -1,15 +1,347 @@
+import time
+
 import pygame
 
+import Constants
+
+
+class Camera:
+    """
+    Viewport onto the world, which may be larger than the screen. Objects are positioned in world coordinates and
+    the camera's position is the world point shown at the top left corner of the screen. Panned with the arrow keys
+    """
+    PAN_KEYS = {pygame.K_LEFT: (-1, 0), pygame.K_RIGHT: (1, 0), pygame.K_UP: (0, -1), pygame.K_DOWN: (0, 1)}
+
+    def __init__(self, view_size, world_size, pan_speed=Constants.CAMERA_PAN_SPEED):
+        """
+
+        :param view_size: (width, height) of the screen
+        :param world_size: (width, height) of the world. The camera never shows anything outside of it
+        :param pan_speed: Pixels per second the camera pans at while a pan key is held
+        """
+        self.view_size = tuple(view_size)
+        self.world_size = tuple(world_size)
+        self.pan_speed = pan_speed
+
+        # World position of the top left corner of the screen. Kept fractional so slow pans still move
+        self.x = 0
+        self.y = 0
+        # Position before the last simulation step, the view is drawn in between
+        self.previous = (0, 0)
+
+        # Pan keys currently held
+        self.held_keys = set()
+
+    # Whole pixel world position of the top left corner of the screen
+    @property
+    def pos(self):
+        return int(round(self.x)), int(round(self.y))
+
+    # World area shown on the screen
+    @property
+    def rect(self):
+        return pygame.Rect(self.pos, self.view_size)
+
+    # World area shown on a frame drawn alpha of a simulation step after the last step
+    def view_at(self, alpha):
+        x = self.previous[0] + (self.x - self.previous[0]) * alpha
+        y = self.previous[1] + (self.y - self.previous[1]) * alpha
+        return pygame.Rect((int(round(x)), int(round(y))), self.view_size)
+
+    # Added to world positions to get screen positions
+    @property
+    def offset(self):
+        x, y = self.pos
+        return -x, -y
+
+    def to_screen(self, pos):
+        x, y = self.pos
+        return pos[0] - x, pos[1] - y
+
+    def to_world(self, pos):
+        x, y = self.pos
+        return pos[0] + x, pos[1] + y
+
+    # Moves the top left corner of the screen to the world position pos, kept inside the world
+    def move_to(self, pos):
+        self.x = min(max(0, pos[0]), max(0, self.world_size[0] - self.view_size[0]))
+        self.y = min(max(0, pos[1]), max(0, self.world_size[1] - self.view_size[1]))
+
+    def pan(self, dx, dy):
+        self.move_to((self.x + dx, self.y + dy))
+
+    def center_on(self, pos):
+        self.move_to((pos[0] - self.view_size[0] / 2, pos[1] - self.view_size[1] / 2))
+
+    # Pans while pan keys are held. Driven by the simulation step's events so recorded sessions replay the same view
+    def update(self, events, time_delta):
+        self.previous = (self.x, self.y)
+        for event in events:
+            if event.type == pygame.KEYDOWN and event.key in Camera.PAN_KEYS:
+                self.held_keys.add(event.key)
+            elif event.type == pygame.KEYUP:
+                self.held_keys.discard(event.key)
+        if self.held_keys:
+            dx = sum(Camera.PAN_KEYS[key][0] for key in self.held_keys)
+            dy = sum(Camera.PAN_KEYS[key][1] for key in self.held_keys)
+            self.pan(dx * self.pan_speed * time_delta, dy * self.pan_speed * time_delta)
+
 
 class Renderer:
-    def __init__(self):
-        pass
+    def __init__(self, dirty_rects=False, camera=None):
+        """
+
+        :param dirty_rects: Only redraw the parts of the screen that changed since the last frame
+        :param camera: Camera the world is seen through. Defaults to a world the size of the screen
+        """
+        self.dirty_rects = dirty_rects
+        self.camera = camera if camera is not None else Camera(Constants.SCREEN_SIZE, Constants.SCREEN_SIZE)
+
+        # World area shown by the frame being drawn, and the one the screen was last drawn at. The whole screen is
+        # redrawn when the view moved
+        self.view = self.camera.rect
+        self.drawn_view = None
+
+        # Fraction of a simulation step since the last step, moving objects are drawn in between their positions
+        self.alpha = 1.0
+
+        # Objects drawn and objects skipped for being outside the viewport in the last frame
+        self.drawn = 0
+        self.culled = 0
+
+        # Screen area each object covered when it was last drawn in dirty rect mode
+        self.previous_rects = {}
+
+        # Forces the next dirty rect frame to redraw everything
+        self.full_redraw = True
+
+        # Background with the static objects beneath every other object composited onto it, the static objects and
+        # rects it was built from, and those objects as a set
+        self.static_layer = None
+        self.static_key = None
+        self.layered = set()
 
-    def render(self, manager, screen, time_delta):
-        # Draws background
-        screen.blit(manager.background_image, (0, 0))
+        # Draws one object, swapped for render_object_profiled while profiling
+        self.draw_object = self.render_object
 
-        # Renders objects
+        # Profiler timing the current frame, None when not profiling
+        self.profiler = None
+        self.profiled_time = 0
+
+    def toggle_dirty_rects(self):
+        self.dirty_rects = not self.dirty_rects
+        self.full_redraw = True
+
+    def render(self, manager, screen, time_delta, alpha=1.0):
+        """
+        Draws the frame
+
+        :param alpha: Fraction of a simulation step since the last step
+        :return: List of screen rects that changed, or None if the whole screen was redrawn
+        """
+        self.alpha = alpha
+        self.view = self.camera.view_at(alpha)
+        if manager.profiler.enabled:
+            return self.render_profiled(manager, screen, time_delta)
+
+        if self.update_static_layer(manager) or self.view != self.drawn_view:
+            self.full_redraw = True
+
+        if not self.dirty_rects or self.full_redraw:
+            self.render_full(manager, screen, time_delta)
+            return None
+        return self.render_dirty(manager, screen, time_delta)
+
+    # Renders with the time spent drawing each object class recorded, and the rest recorded as "render other"
+    def render_profiled(self, manager, screen, time_delta):
+        self.profiler = manager.profiler
+        self.profiled_time = 0
+        self.draw_object = self.render_object_profiled
+        start = time.perf_counter()
+        try:
+            if self.update_static_layer(manager) or self.view != self.drawn_view:
+                self.full_redraw = True
+            if not self.dirty_rects or self.full_redraw:
+                self.render_full(manager, screen, time_delta)
+                changed_rects = None
+            else:
+                changed_rects = self.render_dirty(manager, screen, time_delta)
+        finally:
+            self.draw_object = self.render_object
+            self.profiler = None
+        manager.profiler.add("render other", time.perf_counter() - start - self.profiled_time)
+        return changed_rects
+
+    # Screen rect covered by an object and the offset to draw it at, or None if it is outside of the screen. World
+    # objects are tested against the view in world coordinates, at their position after the last step, so culled
+    # objects cost no rect copies
+    def screen_rect(self, obj, view, screen_rect, offset):
+        rect = obj.get_render_rect()
+        if obj.SCREEN_SPACE:
+            return (rect.copy(), (0, 0)) if screen_rect.colliderect(rect) else None
+        if not view.colliderect(rect):
+            return None
+        if obj.previous_center is not None:
+            dx, dy = obj.draw_offset(self.alpha)
+            offset = (offset[0] + dx, offset[1] + dy)
+        return rect.move(offset), offset
+
+    def placed_objects(self, manager, view, screen_rect):
+        """
+        Finds the objects to draw this frame. With a component store every object is culled and sorted at once,
+        otherwise each object is tested in z order
+
+        :return: (list of (object, screen rect, offset to draw it at) in z order, number of objects culled)
+        """
+        offset = (-view.x, -view.y)
+        placed = []
+        components = manager.components
+        if components is None:
+            culled = 0
+            for obj in manager.game_objects:
+                if not obj.do_render:
+                    continue
+                found = self.screen_rect(obj, view, screen_rect, offset)
+                if found is None:
+                    culled += 1
+                else:
+                    placed.append((obj, found[0], found[1]))
+            return placed, culled
+
+        objects, unculled, draw_offsets, culled = components.visible(view, self.alpha)
+        ox, oy = offset
+        for obj, test, (dx, dy) in zip(objects, unculled, draw_offsets):
+            if test:
+                found = self.screen_rect(obj, view, screen_rect, offset)
+                if found is None:
+                    culled += 1
+                else:
+                    placed.append((obj, found[0], found[1]))
+            else:
+                obj_offset = (ox + dx, oy + dy)
+                placed.append((obj, obj.image_rect.move(obj_offset), obj_offset))
+        return placed, culled
+
+    def render_full(self, manager, screen, time_delta):
+        # Draws background and static objects
+        screen.fill((0, 0, 0))
+        view = self.view
+        screen.blit(self.static_layer, (0, 0), view)
+
+        # Renders the objects on the screen
+        self.previous_rects = {}
+        placed, culled = self.placed_objects(manager, view, screen.get_rect())
+        for obj, rect, offset in placed:
+            self.draw_object(obj, screen, time_delta, offset)
+            obj.dirty = False
+            self.previous_rects[obj] = rect
+
+        self.drawn, self.culled = len(placed), culled
+        self.drawn_view = view
+        self.full_redraw = False
+
+    def render_dirty(self, manager, screen, time_delta):
+        # Finds the areas of objects on the screen that appeared, disappeared, moved or changed. The camera didn't
+        # move since the last frame, otherwise the screen would be redrawn fully
+        view = self.view
+        screen_rect = screen.get_rect()
+        changed = []
+        current_rects = {}
+        offsets = {}
+        placed, culled = self.placed_objects(manager, view, screen_rect)
+        for obj, rect, offset in placed:
+            current_rects[obj] = rect
+            offsets[obj] = offset
+            previous = self.previous_rects.pop(obj, None)
+            if previous is None:
+                changed.append(rect)
+            elif obj.dirty or previous != rect:
+                changed.append(previous)
+                changed.append(rect)
+
+        # Whatever is left was drawn last frame but is gone now
+        changed.extend(self.previous_rects.values())
+        self.previous_rects = current_rects
+
+        changed = self.merge_rects([rect.clip(screen_rect) for rect in changed])
+
+        # Restores the background under each changed area and redraws the objects overlapping it in z order
+        for rect in changed:
+            screen.set_clip(rect)
+            screen.blit(self.static_layer, rect, rect.move(view.topleft))
+            for obj, obj_rect in current_rects.items():
+                if rect.colliderect(obj_rect):
+                    self.draw_object(obj, screen, time_delta, offsets[obj])
+        screen.set_clip(None)
+
+        for obj in current_rects:
+            obj.dirty = False
+
+        self.drawn, self.culled = len(current_rects), culled
+        return changed
+
+    # Static objects in the static layer only draw their overlay, their base is already part of it
+    def render_object(self, obj, screen, time_delta, offset):
+        if obj.is_static:
+            if obj not in self.layered:
+                obj.render_static(screen, offset)
+            obj.render_overlay(screen, time_delta, offset)
+        else:
+            obj.render(screen, time_delta, offset)
+
+    # Stands in for render_object while profiling
+    def render_object_profiled(self, obj, screen, time_delta, offset):
+        start = time.perf_counter()
+        self.render_object(obj, screen, time_delta, offset)
+        elapsed = time.perf_counter() - start
+        self.profiler.add_class("render", type(obj), elapsed)
+        self.profiled_time += elapsed
+
+    # Rebuilds the static layer if a static object was added, removed or moved, or now belongs on the other side of
+    # the lowest other object. Returns whether it was rebuilt
+    def update_static_layer(self, manager):
+        # The layer is drawn beneath every other object, so only static objects with a z order below all of them can
+        # be part of it. The others are drawn in z order like any object
+        lowest = None
         for obj in manager.game_objects:
-            if obj.do_render:
-                obj.render(screen, time_delta)
+            if obj.do_render and not obj.is_static:
+                lowest = obj.z_order
+                break
+        static_objects = [obj for obj in manager.by_tag("static")
+                          if obj.do_render and (lowest is None or obj.z_order < lowest)]
+        key = tuple((obj, tuple(obj.image_rect)) for obj in static_objects)
+        if self.static_layer is not None and key == self.static_key:
+            return False
+
+        self.static_layer = self.tile_background(manager.background_image, self.camera.world_size)
+        for obj in sorted(static_objects, key=lambda i: i.z_order):
+            obj.render_static(self.static_layer)
+        self.static_key = key
+        self.layered = set(static_objects)
+        return True
+
+    # Background covering the whole world, the background image repeated as often as needed
+    @staticmethod
+    def tile_background(image, world_size):
+        if image.get_size() == tuple(world_size):
+            return image.copy()
+        layer = pygame.Surface(world_size, 0, image)
+        for x in range(0, world_size[0], image.get_width()):
+            for y in range(0, world_size[1], image.get_height()):
+                layer.blit(image, (x, y))
+        return layer
+
+    # Merges overlapping rects so no area is redrawn twice
+    @staticmethod
+    def merge_rects(rects):
+        merged = []
+        for rect in rects:
+            if not rect.width or not rect.height:
+                continue
+            rect = rect.copy()
+            overlapping = rect.collidelist(merged)
+            while overlapping != -1:
+                rect.union_ip(merged.pop(overlapping))
+                overlapping = rect.collidelist(merged)
+            merged.append(rect)
+        return merged
@@ -0,0 +1,138 @@
+"""
+Recording and deterministic replay of a game session.
+
+A seeded world only depends on its input, so a session can be reproduced exactly from the seed plus, for every
+frame, the time delta, the mouse position and the events the world saw. A recording is a header followed by a
+zlib stream of frame records, closed by a digest of the final world state so a replay can check it ended up in
+the same place. Snapshots loaded while recording (--load, F9) replace the world mid-session, so they are recorded
+whole in between the frames and loaded again by the replay.
+"""
+import hashlib
+import struct
+import zlib
+
+import pygame
+
+import Snapshot
+
+MAGIC = b"CPRL"
+VERSION = 2
+HEADER = struct.Struct("<4sHq")  # magic, version, seed
+FRAME = struct.Struct("<dhhH")  # time delta, mouse x, mouse y, number of events
+EVENT = struct.Struct("<Iii")  # type, key, mod
+END = 0xFFFF  # Event count marking the final record, which holds the digest instead of events
+LOAD = 0xFFFE  # Event count marking a loaded snapshot, which holds the snapshot's size and data instead of events
+SNAPSHOT_SIZE = struct.Struct("<I")
+
+# Only events objects react to are recorded
+RECORDED_EVENTS = (pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP)
+
+
+class InvalidRecording(Exception):
+    def __init__(self, reason):
+        super().__init__("Not a valid recording: " + reason)
+
+
+# Hash of everything a snapshot holds about the world. Two worlds with the same digest are in the same state
+def state_digest(objects):
+    return hashlib.sha1(Snapshot.encode(objects)).digest()
+
+
+class Recorder:
+    """
+    Streams the input of each frame to a file. Data is compressed as it is written, so a long session never
+    builds up in memory
+    """
+    def __init__(self, path, seed):
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed))
+        self.compressor = zlib.compressobj(6)
+        self.frames = 0
+
+    def record_frame(self, time_delta, mouse_pos, events):
+        events = [event for event in events if event.type in RECORDED_EVENTS]
+        parts = [FRAME.pack(time_delta, mouse_pos[0], mouse_pos[1], len(events))]
+        for event in events:
+            parts.append(EVENT.pack(event.type, getattr(event, "key", 0), getattr(event, "mod", 0)))
+        self.file.write(self.compressor.compress(b"".join(parts)))
+        self.frames += 1
+
+    # Records that the world was replaced by a snapshot before the next frame. data is the snapshot file's content
+    def record_load(self, data):
+        record = FRAME.pack(0, 0, 0, LOAD) + SNAPSHOT_SIZE.pack(len(data))
+        self.file.write(self.compressor.compress(record) + self.compressor.compress(data))
+
+    # Ends the recording with the digest of the world the session ended in
+    def close(self, manager):
+        end = FRAME.pack(0, 0, 0, END) + state_digest(manager.game_objects)
+        self.file.write(self.compressor.compress(end) + self.compressor.flush())
+        self.file.close()
+
+
+def read(path):
+    """
+    Reads a recording
+
+    :return: (seed, list of (time delta, mouse position, events) per frame, dict of the snapshot data loaded before
+        each frame by frame number, final digest). A snapshot loaded after the last frame is under len(frames)
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise InvalidRecording("file is truncated")
+    magic, version, seed = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise InvalidRecording("bad magic number")
+    if version != VERSION:
+        raise InvalidRecording("unsupported version {}".format(version))
+
+    body = zlib.decompress(data[HEADER.size:])
+    frames = []
+    loads = {}
+    offset = 0
+    while True:
+        if offset + FRAME.size > len(body):
+            raise InvalidRecording("missing final digest")
+        time_delta, mouse_x, mouse_y, count = FRAME.unpack_from(body, offset)
+        offset += FRAME.size
+        if count == END:
+            return seed, frames, loads, body[offset:]
+        if count == LOAD:
+            size, = SNAPSHOT_SIZE.unpack_from(body, offset)
+            offset += SNAPSHOT_SIZE.size
+            loads[len(frames)] = body[offset:offset + size]
+            offset += size
+            continue
+        events = []
+        for _ in range(count):
+            event_type, key, mod = EVENT.unpack_from(body, offset)
+            offset += EVENT.size
+            events.append(pygame.event.Event(event_type, key=key, mod=mod))
+        frames.append((time_delta, (mouse_x, mouse_y), events))
+
+
+def replay(path, manager_factory):
+    """
+    Replays a recording into a fresh headless world, frame by frame with the recorded time deltas. Recorded snapshots
+    replace the world before the frame they were loaded at
+
+    :param path: Recording to replay
+    :param manager_factory: Called with the recorded seed, returns the headless Manager to replay into
+    :return: (the manager, number of frames replayed, whether the final state matches the recorded one)
+    """
+    seed, frames, loads, digest = read(path)
+    manager = manager_factory(seed)
+    for frame, (time_delta, mouse_pos, events) in enumerate(frames):
+        if frame in loads:
+            manager.restore(loads[frame])
+        manager.mouse_pos = mouse_pos
+        manager.events = events
+        if manager.profiler.enabled:
+            manager.profiler.begin_frame()
+            manager.step(time_delta)
+            manager.profiler.end_frame()
+        else:
+            manager.step(time_delta)
+    if len(frames) in loads:
+        manager.restore(loads[len(frames)])
+    return manager, len(frames), state_digest(manager.game_objects) == digest
@@ -0,0 +1,52 @@
+import heapq
+import itertools
+
+
+class Scheduler:
+    """
+    Heap of callbacks due at a future tick. Cancelled entries are left in the heap and skipped when they come up,
+    so cancelling is constant time
+    """
+    def __init__(self):
+        self.heap = []  # [tick, sequence number, callback, args]
+        self.counter = itertools.count()  # Runs callbacks due on the same tick in the order they were scheduled
+
+    def schedule(self, tick, callback, *args):
+        """
+        Calls callback(*args) once tick has been reached
+
+        :return: Entry that can be passed to cancel()
+        """
+        entry = [tick, next(self.counter), callback, args]
+        heapq.heappush(self.heap, entry)
+        return entry
+
+    @staticmethod
+    def cancel(entry):
+        entry[2] = None
+
+    # Whether an entry still has to run
+    @staticmethod
+    def pending(entry):
+        return entry[2] is not None
+
+    def run_due(self, tick):
+        """
+        Runs every callback due at or before tick, in tick order. Callbacks may schedule further callbacks, those
+        already due run in the same call
+        """
+        heap = self.heap
+        while heap and heap[0][0] <= tick:
+            entry = heapq.heappop(heap)
+            callback = entry[2]
+            if callback is not None:
+                entry[2] = None
+                callback(*entry[3])
+
+    def clear(self):
+        for entry in self.heap:
+            entry[2] = None
+        self.heap = []
+
+    def __len__(self):
+        return sum(1 for entry in self.heap if entry[2] is not None)
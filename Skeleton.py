@@ -1,6 +1,10 @@
 import pygame
 from enum import IntEnum
 import math
+
+import numpy as np
+
+import Constants
 import Utils
 
 
@@ -10,6 +14,10 @@ class InsufficientBoneData(Exception):
 
 
 class Bone:
+    """
+    Description of one bone of a rig in its rest pose. Bones are connected into a rig with add_connection and then
+    handed to a Skeleton, which does the posing. Angles are in radians, counter-clockwise with y pointing up
+    """
 
     class NodeTypes(IntEnum):
         START_NODE = 0
@@ -18,12 +26,12 @@ class Bone:
     def __init__(self, meat_image, meat_start_pt, bone_z_order, start_node_pos=None, end_node_pos=None, node_angle=None, length=None):
         """
 
-        :param meat_image: Pygame surface of image
+        :param meat_image: Pygame surface of image, drawn in the bone's rest pose. None for a bone without meat
         :param meat_start_pt: Offset from top left corner of image where starting node links
         :param bone_z_order: In a skeleton, what order to draw this bone in
         :param start_node_pos: Offset from center where bone starts
         :param end_node_pos: Offset from center where bone ends
-        :param node_angle: Angle between node points
+        :param node_angle: Angle between node points, in degrees
         :param length: Constant length of bone
         """
         # The exact offset positions of the 2 nodes
@@ -49,8 +57,8 @@ class Bone:
             self.sNodePos = start_node_pos
 
             # Determines eNodePos
-            self.eNodePos = (start_node_pos[0] + length * math.cos(node_angle),
-                             start_node_pos[1] + length * math.sin(node_angle))
+            self.eNodePos = (start_node_pos[0] + length * math.cos(self.node_angle),
+                             start_node_pos[1] - length * math.sin(self.node_angle))
 
         elif end_node_pos is not None and node_angle is not None and length is not None:
             raise InsufficientBoneData
@@ -75,14 +83,16 @@ class Bone:
         # All bone connections
         self.sNodeConnects = []  # {"bone": <Bone>, "node": <START_NODE or END_NODE>}
         self.eNodeConnects = []
-        self.add_connection()
+
+        # (parent bone, parent's node, own node) this bone hangs off, None for the root of a rig
+        self.parent = None
 
     # self bone keeps their node positions while bone2 inherits!!!
     def add_connection(self, node, bone_other, node_other):  # node/node_other are NodeTypes
         """
 
         :param node: Which end of this bone to connect to
-        :param bone_other: Other bone to connect
+        :param bone_other: Other bone to connect. It becomes a child of this bone
         :param node_other: Other bone's connecting end
         """
         if node == Bone.NodeTypes.START_NODE:
@@ -96,6 +106,7 @@ class Bone:
             bone_other.sNodeConnects.append({"bone": self, "node": node})
         else:
             bone_other.eNodeConnects.append({"bone": self, "node": node})
+        bone_other.parent = (self, node, node_other)
 
         bone_other.set_node(*new_pos, node_other)
 
@@ -132,10 +143,159 @@ class Bone:
 
 
 class Skeleton:
+    """
+    Posable rig built from connected bones. The rig is flattened into arrays in topological order (parents before
+    children) so forward kinematics of every bone, or of many skeletons sharing one rig, is a few array operations.
+    The pose is the angle of each bone relative to its parent (absolute for roots) and the position of each root's
+    attaching node, as an offset from the skeleton's center
+    """
     def __init__(self, bones):
-        self.bones = bones
+        self.bones = list(bones)
+        self.build()
+
+    # Flattens the bones' connections and rest pose into the rig arrays. Call again after connecting bones
+    def build(self):
+        # Topological order, roots first
+        order = [bone for bone in self.bones if bone.parent is None]
+        for bone in order:
+            order += [connection["bone"] for connection in bone.sNodeConnects + bone.eNodeConnects
+                      if connection["bone"].parent is not None and connection["bone"].parent[0] is bone]
+        self.order = order
+        index = {bone: i for i, bone in enumerate(order)}
+        count = len(order)
+        # Array row of each bone, in the order the bones were given
+        self.rows = [index[bone] for bone in self.bones]
+
+        self.parents = np.array([index[bone.parent[0]] if bone.parent is not None else -1 for bone in order])
+        is_child = self.parents >= 0
+        self.lengths = np.array([bone.length for bone in order], dtype=float)
+        # Whether a bone hangs off its parent's end node, and whether it hangs by its own end node
+        self.from_parent_end = np.array([bone.parent is not None and bone.parent[1] == Bone.NodeTypes.END_NODE
+                                         for bone in order])
+        self.by_own_end = np.array([bone.parent is not None and bone.parent[2] == Bone.NodeTypes.END_NODE
+                                    for bone in order])
+
+        # ancestors[i, j] is 1 when bone j is bone i or one of its ancestors, so summing a per-bone quantity down
+        # the chain from the root to every bone is ancestors @ quantity
+        self.ancestors = np.eye(count)
+        for i in range(count):
+            if is_child[i]:
+                self.ancestors[i] += self.ancestors[self.parents[i]]
+
+        rest_angles = np.array([bone.node_angle for bone in order], dtype=float)
+        self.rest_angles = rest_angles
+        self.angles = rest_angles.copy()
+        self.angles[is_child] -= rest_angles[self.parents[is_child]]
+        self.root_positions = np.array([bone.sNodePos for bone in order], dtype=float)
+
+        # Meat images are drawn in z order
+        self.draw_order = sorted(range(count), key=lambda i: order[i].z_order)
+        self.meat_offsets = np.zeros((count, 2))
+        for i, bone in enumerate(order):
+            if bone.image is not None:
+                # Offset from the image center to the start node
+                self.meat_offsets[i] = (bone.img_start_node_offset[0] - bone.image.get_width() / 2,
+                                        bone.img_start_node_offset[1] - bone.image.get_height() / 2)
+
+        self.solve()
+
+    # Copy with its own pose that shares the rig with this skeleton, so the two can be solved together
+    def copy(self):
+        skeleton = object.__new__(Skeleton)
+        skeleton.__dict__.update(self.__dict__)
+        skeleton.angles = self.angles.copy()
+        skeleton.root_positions = self.root_positions.copy()
+        skeleton.solve()
+        return skeleton
+
+    def connect(self, bone, node, bone_other, node_other):
+        """
+        Connects bone_other to bone and rebuilds the rig
+
+        :param bone: Index of the parent bone in the bones given to the constructor
+        :param node: Node of the parent bone to connect at
+        :param bone_other: Index of the child bone
+        :param node_other: Child bone's connecting node
+        """
+        self.bones[bone].add_connection(node, self.bones[bone_other], node_other)
+        self.build()
+
+    # Sets the angle of a bone, by its index in the bones given to the constructor, relative to its parent in radians
+    def set_angle(self, bone, angle):
+        self.angles[self.rows[bone]] = angle
+
+    def solve(self):
+        self.world_angles, self.starts, self.ends = Skeleton.forward_kinematics(
+            self.angles, self.root_positions, self.parents, self.lengths, self.from_parent_end, self.by_own_end,
+            self.ancestors)
+
+    @staticmethod
+    def forward_kinematics(angles, root_positions, parents, lengths, from_parent_end, by_own_end, ancestors):
+        """
+        Poses a rig. Leading dimensions of angles and root_positions are batch dimensions, for posing many
+        skeletons sharing the rig at once
+
+        :param angles: (..., bones) angles relative to the parent bone, radians
+        :param root_positions: (..., bones, 2) attaching node position of root bones, ignored for the others
+        :return: (world angles (..., bones), start nodes (..., bones, 2), end nodes (..., bones, 2))
+        """
+        world_angles = angles @ ancestors.T
+        vectors = np.stack((np.cos(world_angles), -np.sin(world_angles)), axis=-1) * lengths[:, None]
+
+        # Each bone's start node is its parent's start node, plus the parent bone if it hangs off the parent's
+        # end, minus itself if it hangs by its own end. Summing these steps down the chain gives every start node
+        is_root = parents < 0
+        steps = np.where(from_parent_end[:, None], vectors[..., np.maximum(parents, 0), :], 0)
+        steps = np.where(is_root[:, None], root_positions, steps)
+        steps = steps - np.where(by_own_end[:, None], vectors, 0)
+        starts = ancestors @ steps
+        return world_angles, starts, starts + vectors
+
+    @staticmethod
+    def solve_many(skeletons):
+        """
+        Solves every skeleton, with one pass per distinct rig
+        """
+        rigs = {}
+        for skeleton in skeletons:
+            rigs.setdefault(id(skeleton.ancestors), []).append(skeleton)
+        for group in rigs.values():
+            rig = group[0]
+            world_angles, starts, ends = Skeleton.forward_kinematics(
+                np.stack([skeleton.angles for skeleton in group]),
+                np.stack([skeleton.root_positions for skeleton in group]),
+                rig.parents, rig.lengths, rig.from_parent_end, rig.by_own_end, rig.ancestors)
+            for i, skeleton in enumerate(group):
+                skeleton.world_angles = world_angles[i]
+                skeleton.starts = starts[i]
+                skeleton.ends = ends[i]
+
+    def render(self, screen, time_delta, center, debug=False):
+        """
+        Draws the meat images of the solved pose, rotated from their rest pose through the shared rotation cache
+
+        :param debug: Also draw the bones as lines
+        """
+        # Images are rotated by quantized angles, so the start node offsets are rotated by the same angles
+        rotations = np.degrees(self.world_angles - self.rest_angles)
+        rotations = np.round(rotations / Constants.ROTATION_STEP) * Constants.ROTATION_STEP % 360
+        radians = np.radians(rotations)
+        cos, sin = np.cos(radians), np.sin(radians)
+        offsets = self.meat_offsets
+        # pygame rotates counter-clockwise on screen, which is clockwise in y down coordinates
+        rotated = np.stack((offsets[:, 0] * cos + offsets[:, 1] * sin,
+                            -offsets[:, 0] * sin + offsets[:, 1] * cos), axis=-1)
+        image_centers = self.starts - rotated + (center[0], center[1])
 
-    def render(self, screen, time_delta, center):
-        for bone in self.bones:
-            bone.render(screen, time_delta, center)
+        for i in self.draw_order:
+            bone = self.order[i]
+            if bone.image is None:
+                continue
+            image = Utils.rotate_image(bone.image, rotations[i])
+            screen.blit(image, image.get_rect(center=tuple(image_centers[i].tolist())))
 
+        if debug:
+            for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+                pygame.draw.line(screen, (0, 0, 255), Bone.get_pos(center, start), Bone.get_pos(center, end))
+                pygame.draw.circle(screen, (255, 0, 0), Bone.get_pos(center, start), 4, 2)
+                pygame.draw.circle(screen, (0, 255, 0), Bone.get_pos(center, end), 4, 2)
@@ -0,0 +1,419 @@
+"""
+Compact binary snapshots of a Manager's world.
+
+A snapshot is a header followed by a zlib compressed body. The body holds a string table (type names, tags and
+string fields) and one group per object type, in which every field is packed as one array for all objects of
+that type. Objects are numbered in game order so fields can reference other objects (e.g. Creature.food).
+
+The body may be followed by parts: snapshots of objects kept apart from the world, e.g. chunks evicted by streaming,
+stored as they are with the ticks they have been away. Loading adds their objects aged by that many ticks.
+"""
+import os
+import struct
+import sys
+import threading
+import zlib
+
+import pygame
+
+import Object
+
+MAGIC = b"CPWS"
+VERSION = 2
+HEADER = struct.Struct("<4sHI")  # magic, version, uncompressed body size
+PART = struct.Struct("<qI")  # ticks the part's objects have been away, size of its snapshot data
+
+# Lifetime of objects that live forever
+NO_LIFETIME = -2 ** 31
+# Reference to no object
+NO_REF = -1
+
+# Types that can be saved, with how to construct one at a position before its fields are restored
+TYPES = {
+    "GUI": lambda center, z_order: Object.GUI(None, z_order, list(center)),
+    "Creature": lambda center, z_order: Object.Creature(None, list(center)),
+    "Grass": lambda center, z_order: Object.Grass(None, tuple(center)),
+    "Kibble": lambda center, z_order: Object.Kibble(None, tuple(center)),
+    "Snack": lambda center, z_order: Object.Snack(None, tuple(center)),
+    "Shack": lambda center, z_order: Object.Shack(None, tuple(center)),
+    "Pond": lambda center, z_order: Object.Pond(None, tuple(center)),
+}
+
+
+class InvalidSnapshot(Exception):
+    def __init__(self, reason):
+        super().__init__("Not a valid world snapshot: " + reason)
+
+
+# Errors decoding truncated or corrupt snapshot data can raise
+DECODE_ERRORS = (ValueError, IndexError, struct.error, zlib.error, InvalidSnapshot)
+
+
+class Writer:
+    def __init__(self):
+        self.parts = []
+        self.strings = {}
+
+    def string(self, value):
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    # Packs values as an array of fmt
+    def pack(self, fmt, values):
+        self.parts.append(struct.pack("<{}{}".format(len(values), fmt), *values))
+
+    # Packs values as one record laid out by fmt
+    def pack_record(self, fmt, *values):
+        self.parts.append(struct.pack("<" + fmt, *values))
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+        self.strings = []
+
+    # Reads an array of count fmt values
+    def unpack(self, fmt, count):
+        return self.unpack_record("{}{}".format(count, fmt))
+
+    # Reads one record laid out by fmt
+    def unpack_record(self, fmt):
+        layout = struct.Struct("<" + fmt)
+        values = layout.unpack_from(self.data, self.offset)
+        self.offset += layout.size
+        return values
+
+
+# Packs one type specific field of every object in a group
+def pack_field(writer, objects, attribute, fmt, refs):
+    if fmt == "ref":
+        writer.pack("i", [refs.get(getattr(obj, attribute), NO_REF) for obj in objects])
+    elif fmt == "s":
+        writer.pack("H", [writer.string(getattr(obj, attribute)) for obj in objects])
+    elif fmt == "2d":
+        writer.pack("d", [value for obj in objects for value in getattr(obj, attribute)[:2]])
+    else:
+        writer.pack(fmt, [getattr(obj, attribute) for obj in objects])
+
+
+# Restores one type specific field of every object in a group. References are resolved by decode()
+def unpack_field(reader, objects, attribute, fmt):
+    count = len(objects)
+    if fmt == "s":
+        for obj, index in zip(objects, reader.unpack("H", count)):
+            setattr(obj, attribute, reader.strings[index])
+    elif fmt == "2d":
+        values = reader.unpack("d", count * 2)
+        for i, obj in enumerate(objects):
+            setattr(obj, attribute, [values[i * 2], values[i * 2 + 1]])
+    else:
+        for obj, value in zip(objects, reader.unpack(fmt, count)):
+            setattr(obj, attribute, value)
+
+
+# Attribute names declared in the __slots__ of a type and its bases, by type
+_slot_names = {}
+
+
+def slot_names(cls):
+    names = _slot_names.get(cls)
+    if names is None:
+        names = _slot_names[cls] = tuple(name for base in reversed(cls.__mro__)
+                                         for name in base.__dict__.get("__slots__", ()))
+    return names
+
+
+def clone(template):
+    """
+    Copies an object without running its constructor, which is much faster than constructing each loaded object.
+    Lists and rects are copied, keeping attributes that share one (e.g. Creature.pos and center) shared, and
+    everything else, such as surfaces, is shared with the template
+    """
+    obj = object.__new__(type(template))
+    copies = {}
+    for name in slot_names(type(template)):
+        try:
+            value = getattr(template, name)
+        except AttributeError:
+            continue
+        if type(value) is list or type(value) is pygame.Rect:
+            copied = copies.get(id(value))
+            if copied is None:
+                copied = copies[id(value)] = value.copy()
+            value = copied
+        elif type(value) is Object.TagSet:
+            value = Object.TagSet(obj, value)
+        setattr(obj, name, value)
+    return obj
+
+
+def encode(objects):
+    """
+    Packs objects into an uncompressed snapshot body
+
+    :param objects: Objects to save, in game order
+    :return: Body bytes, to be passed to compress()
+    """
+    objects = [obj for obj in objects if type(obj).__name__ in TYPES]
+    refs = {obj: i for i, obj in enumerate(objects)}
+
+    groups = {}
+    for obj in objects:
+        groups.setdefault(type(obj), []).append(obj)
+
+    writer = Writer()
+    for cls, group in groups.items():
+        writer.pack_record("HI", writer.string(cls.__name__), len(group))
+        writer.pack("I", [refs[obj] for obj in group])
+        writer.pack("d", [value for obj in group for value in (obj.center[0], obj.center[1])])
+        writer.pack("i", [obj.lifetime if obj.lifetime is not None else NO_LIFETIME for obj in group])
+        writer.pack("I", [obj.exist_time for obj in group])
+        writer.pack("i", [obj.z_order for obj in group])
+        tags = [sorted(obj.tags) for obj in group]
+        writer.pack("B", [len(obj_tags) for obj_tags in tags])
+        writer.pack("H", [writer.string(tag) for obj_tags in tags for tag in obj_tags])
+        for attribute, fmt in cls.SNAPSHOT_FIELDS:
+            pack_field(writer, group, attribute, fmt, refs)
+
+    # The string table goes first so it is known when reading the groups
+    strings = list(writer.strings)
+    header = Writer()
+    header.pack_record("HIH", len(strings), len(objects), len(groups))
+    for string in strings:
+        encoded = string.encode("utf-8")
+        header.pack_record("H", len(encoded))
+        header.parts.append(encoded)
+    return b"".join(header.parts + writer.parts)
+
+
+def decode(data, templates=None):
+    """
+    Rebuilds the objects of a snapshot body. The objects are not added to any manager yet
+
+    :param templates: Type name -> object to clone the objects of that type from. Decoding types with a template
+        constructs no objects, which makes it safe off the game thread
+    :return: Objects in the order they were saved
+    """
+    reader = Reader(data)
+    string_count, object_count, group_count = reader.unpack_record("HIH")
+    for _ in range(string_count):
+        length, = reader.unpack_record("H")
+        reader.strings.append(data[reader.offset:reader.offset + length].decode("utf-8"))
+        reader.offset += length
+
+    loaded = [None] * object_count
+    fields = []
+    for _ in range(group_count):
+        type_index, count = reader.unpack_record("HI")
+        type_name = reader.strings[type_index]
+        if type_name not in TYPES:
+            raise InvalidSnapshot("unknown object type " + type_name)
+        construct = TYPES[type_name]
+
+        indices = reader.unpack("I", count)
+        centers = reader.unpack("d", count * 2)
+        lifetimes = reader.unpack("i", count)
+        exist_times = reader.unpack("I", count)
+        z_orders = reader.unpack("i", count)
+        tag_counts = reader.unpack("B", count)
+        tag_ids = reader.unpack("H", sum(tag_counts))
+
+        # The first object of each type is constructed, the others are cloned from it
+        group = []
+        tag_pos = 0
+        template = templates.get(type_name) if templates is not None else None
+        for i in range(count):
+            center = (centers[i * 2], centers[i * 2 + 1])
+            if template is None:
+                obj = template = construct(center, z_orders[i])
+            else:
+                obj = clone(template)
+                if type(obj.center) is list:
+                    obj.center[0], obj.center[1] = center
+                else:
+                    obj.center = center
+            obj.lifetime = lifetimes[i] if lifetimes[i] != NO_LIFETIME else None
+            obj.exist_time = exist_times[i]
+            obj.z_order = z_orders[i]
+            obj.tags.clear()
+            obj.tags.update(reader.strings[tag] for tag in tag_ids[tag_pos:tag_pos + tag_counts[i]])
+            tag_pos += tag_counts[i]
+            loaded[indices[i]] = obj
+            group.append(obj)
+
+        # References may point at objects of groups that haven't been read yet, so they are resolved at the end
+        for attribute, fmt in type(group[0]).SNAPSHOT_FIELDS:
+            if fmt == "ref":
+                fields.append((group, attribute, reader.unpack("i", count)))
+            else:
+                unpack_field(reader, group, attribute, fmt)
+
+    for group, attribute, refs in fields:
+        for obj, ref in zip(group, refs):
+            setattr(obj, attribute, loaded[ref] if ref != NO_REF else None)
+
+    for obj in loaded:
+        obj.update_rects()
+        obj.on_restore()
+    return loaded
+
+
+def compress(body, parts=()):
+    """
+
+    :param parts: (ticks away, snapshot data) of each part to append
+    """
+    data = [HEADER.pack(MAGIC, VERSION, len(body)), zlib.compress(body, 6)]
+    for ticks, part in parts:
+        data += [PART.pack(ticks, len(part)), part]
+    return b"".join(data)
+
+
+def unpack(data):
+    """
+    Splits snapshot data into its body and parts
+
+    :return: (uncompressed body, list of (ticks away, snapshot data) of the parts)
+    """
+    if len(data) < HEADER.size:
+        raise InvalidSnapshot("file is truncated")
+    magic, version, size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise InvalidSnapshot("bad magic number")
+    # Version 1 snapshots are the same without parts
+    if version not in (1, VERSION):
+        raise InvalidSnapshot("unsupported version {}".format(version))
+    decompressor = zlib.decompressobj()
+    body = decompressor.decompress(data[HEADER.size:])
+    if len(body) != size or not decompressor.eof:
+        raise InvalidSnapshot("body is truncated")
+
+    parts = []
+    rest = decompressor.unused_data
+    offset = 0
+    while offset < len(rest):
+        if offset + PART.size > len(rest):
+            raise InvalidSnapshot("part is truncated")
+        ticks, part_size = PART.unpack_from(rest, offset)
+        offset += PART.size
+        if offset + part_size > len(rest):
+            raise InvalidSnapshot("part is truncated")
+        parts.append((ticks, rest[offset:offset + part_size]))
+        offset += part_size
+    return body, parts
+
+
+def decompress(data):
+    return unpack(data)[0]
+
+
+def age(objects, ticks):
+    """
+    Ages objects by ticks spent away from the world
+
+    :return: (objects still alive, objects whose lifetime ran out while away)
+    """
+    alive = []
+    expired = []
+    for obj in objects:
+        if obj.lifetime is not None:
+            obj.lifetime -= ticks
+            if obj.lifetime <= 0:
+                expired.append(obj)
+                continue
+        obj.exist_time += ticks
+        alive.append(obj)
+    return alive, expired
+
+
+# Writes data to path through a temporary file, so a crash never leaves a half written snapshot behind
+def write_file(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+# Parts of manager's world kept apart from it, see Manager.snapshot_parts
+def parts_of(manager):
+    reply = manager.snapshot_parts()
+    return reply.get() if reply is not None else ()
+
+
+def save(manager, path):
+    body = encode(manager.game_objects)
+    write_file(path, compress(body, parts_of(manager)))
+
+
+# Replaces everything in manager's world with the contents of the snapshot at path
+def load(manager, path):
+    with open(path, "rb") as f:
+        restore(manager, f.read())
+
+
+# Replaces everything in manager's world with the contents of a snapshot file's data. A part that can't be decoded
+# (e.g. a chunk file that was corrupt when saved) is left out
+def restore(manager, data):
+    body, parts = unpack(data)
+    objects = decode(body)
+    for i, (ticks, part) in enumerate(parts):
+        try:
+            objects += age(decode(decompress(part)), ticks)[0]
+        except DECODE_ERRORS as e:
+            print("Leaving out part {} of the snapshot: {}".format(i, e), file=sys.stderr)
+    manager.clear_objects()
+    for obj in objects:
+        manager.attach_object(obj)
+
+
+class AutoSaver:
+    """
+    Saves the world every interval seconds of game time. The objects are packed on the game thread so the
+    snapshot is consistent. Waiting for the parts kept apart from the world, compression and writing happen on a
+    background thread
+    """
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.elapsed = 0
+
+        # Latest (body, reply the parts arrive in) waiting to be written. Older ones are dropped if the writer falls
+        # behind
+        self.pending = None
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.write_loop, name="autosave", daemon=True)
+        self.thread.start()
+
+    def update(self, manager, time_delta):
+        self.elapsed += time_delta
+        if self.elapsed >= self.interval:
+            self.elapsed = 0
+            self.save(manager)
+
+    def save(self, manager):
+        body = encode(manager.game_objects)
+        with self.condition:
+            self.pending = (body, manager.snapshot_parts())
+            self.condition.notify()
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                while self.pending is None and self.running:
+                    self.condition.wait()
+                pending, self.pending = self.pending, None
+                if pending is None:
+                    return
+            body, reply = pending
+            write_file(self.path, compress(body, reply.get() if reply is not None else ()))
+
+    # Writes any pending snapshot and stops the writer thread
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
@@ -0,0 +1,162 @@
+import heapq
+
+
+class SpatialHash:
+    """
+    Uniform grid over the world. Every object is stored in each cell covered by its physics rect and its center,
+    so queries only have to look at the cells around the queried area instead of every game object
+    """
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+
+        self.cells = {}  # (cell x, cell y) -> {obj: None}
+        self.obj_cells = {}  # obj -> (x0, y0, x1, y1) cell range the object is stored in
+
+        # Range of cells that have ever held an object, bounds the nearest-neighbour search
+        self.bounds = None
+
+    # Cell range covered by an object's physics rect and center
+    def _cell_range(self, obj):
+        rect = obj.physics_rect
+        cs = self.cell_size
+        left = min(rect.left, int(obj.center[0]))
+        top = min(rect.top, int(obj.center[1]))
+        right = max(rect.right - 1, int(obj.center[0]))
+        bottom = max(rect.bottom - 1, int(obj.center[1]))
+        return left // cs, top // cs, right // cs, bottom // cs
+
+    def insert(self, obj):
+        cell_range = self._cell_range(obj)
+        self.obj_cells[obj] = cell_range
+        x0, y0, x1, y1 = cell_range
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                self.cells.setdefault((x, y), {})[obj] = None
+
+        bounds = self.bounds
+        if bounds is None:
+            self.bounds = cell_range
+        elif x0 < bounds[0] or y0 < bounds[1] or x1 > bounds[2] or y1 > bounds[3]:
+            self.bounds = (min(bounds[0], x0), min(bounds[1], y0), max(bounds[2], x1), max(bounds[3], y1))
+
+    def remove(self, obj):
+        cell_range = self.obj_cells.pop(obj, None)
+        if cell_range is None:
+            return
+        x0, y0, x1, y1 = cell_range
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                cell = self.cells[(x, y)]
+                del cell[obj]
+                if not cell:
+                    del self.cells[(x, y)]
+
+    # Re-buckets an object after it moved. Does nothing if it is still covering the same cells
+    def update(self, obj):
+        cell_range = self.obj_cells.get(obj)
+        if cell_range is None or cell_range == self._cell_range(obj):
+            return
+        self.remove(obj)
+        self.insert(obj)
+
+    def __contains__(self, obj):
+        return obj in self.obj_cells
+
+    def __len__(self):
+        return len(self.obj_cells)
+
+    # Yields each object stored in the given cell range once
+    def _objects_in(self, x0, y0, x1, y1, tag):
+        seen = {}
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                cell = self.cells.get((x, y))
+                if cell is None:
+                    continue
+                for obj in cell:
+                    if obj not in seen and (tag is None or tag in obj.tags):
+                        seen[obj] = None
+        return seen
+
+    def query_radius(self, pos, radius, tag=None):
+        """
+        Returns the objects whose center is closer than radius to pos
+
+        :param pos: Center of the search circle
+        :param radius: Radius of the search circle
+        :param tag: Only return objects carrying this tag
+        """
+        cs = self.cell_size
+        candidates = self._objects_in(int(pos[0] - radius) // cs, int(pos[1] - radius) // cs,
+                                      int(pos[0] + radius) // cs, int(pos[1] + radius) // cs, tag)
+        radius_sq = radius ** 2
+        return [obj for obj in candidates
+                if (obj.center[0] - pos[0]) ** 2 + (obj.center[1] - pos[1]) ** 2 < radius_sq]
+
+    def query_rect(self, rect, tag=None):
+        """
+        Returns the objects whose physics rect overlaps rect
+
+        :param rect: Pygame rect to test against
+        :param tag: Only return objects carrying this tag
+        """
+        cs = self.cell_size
+        candidates = self._objects_in(rect.left // cs, rect.top // cs,
+                                      max(rect.right - 1, rect.left) // cs, max(rect.bottom - 1, rect.top) // cs, tag)
+        return [obj for obj in candidates if obj.physics_rect.colliderect(rect)]
+
+    def query_centers(self, rect, tag=None):
+        """
+        Returns the objects whose center lies in rect, wherever their physics rect is
+
+        :param rect: Pygame rect to test against
+        :param tag: Only return objects carrying this tag
+        """
+        cs = self.cell_size
+        candidates = self._objects_in(rect.left // cs, rect.top // cs,
+                                      max(rect.right - 1, rect.left) // cs, max(rect.bottom - 1, rect.top) // cs, tag)
+        return [obj for obj in candidates if rect.collidepoint(obj.center)]
+
+    def query_nearest(self, pos, k=1, tag=None, max_radius=None):
+        """
+        Returns up to k objects sorted by the distance of their center to pos. Searches rings of cells outwards
+        from pos and stops as soon as no unvisited cell can hold anything closer
+
+        :param pos: Point to search from
+        :param k: Maximum number of objects to return
+        :param tag: Only return objects carrying this tag
+        :param max_radius: Ignore objects further away than this
+        """
+        if self.bounds is None or k <= 0:
+            return []
+
+        cs = self.cell_size
+        cx, cy = int(pos[0]) // cs, int(pos[1]) // cs
+        bx0, by0, bx1, by1 = self.bounds
+        max_ring = max(cx - bx0, bx1 - cx, cy - by0, by1 - cy)
+        if max_radius is not None:
+            max_ring = min(max_ring, int(max_radius // cs) + 1)
+
+        seen = {}
+        found = []  # (distance squared, insertion order, obj)
+        for ring in range(max_ring + 1):
+            # Visits the cells on the border of the square of side 2 * ring + 1 around the start cell
+            for x in range(cx - ring, cx + ring + 1):
+                edge = x == cx - ring or x == cx + ring
+                for y in (range(cy - ring, cy + ring + 1) if edge else (cy - ring, cy + ring)):
+                    cell = self.cells.get((x, y))
+                    if cell is None:
+                        continue
+                    for obj in cell:
+                        if obj in seen or (tag is not None and tag not in obj.tags):
+                            continue
+                        seen[obj] = None
+                        dist_sq = (obj.center[0] - pos[0]) ** 2 + (obj.center[1] - pos[1]) ** 2
+                        if max_radius is None or dist_sq <= max_radius ** 2:
+                            found.append((dist_sq, len(seen), obj))
+
+            # Anything outside this ring is at least ring * cell_size away
+            if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= (ring * cs) ** 2:
+                break
+
+        return [obj for _, _, obj in heapq.nsmallest(k, found)]
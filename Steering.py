@@ -0,0 +1,139 @@
+import numpy as np
+
+import Object
+
+
+class SteeringSystem:
+    """
+    Batched version of Creature.go_to. Creatures queue a target during their pre_update and step() then
+    computes the seek and avoid forces of every creature against every obstacle in one vectorized pass,
+    integrates velocity and position and writes the results back onto the creatures
+    """
+    def __init__(self):
+        # Creatures and targets queued this frame
+        self.creatures = []
+        self.targets = []
+        self.arrive = []
+        self.avoiding = []
+
+        # Per-creature state of the last batch, grown as needed
+        self.capacity = 0
+        self.pos = np.zeros((0, 2))
+        self.vel = np.zeros((0, 2))
+        self.acc = np.zeros((0, 2))
+
+    # Queues a creature to move towards target on the next step, with the arrive and avoid behaviour of go_to
+    def request(self, creature, target, arrive=True, avoiding=True):
+        self.creatures.append(creature)
+        self.targets.append((target[0], target[1]))
+        self.arrive.append(arrive)
+        self.avoiding.append(avoiding)
+
+    def _reserve(self, count):
+        if count > self.capacity:
+            self.capacity = max(count, self.capacity * 2)
+            self.pos = np.zeros((self.capacity, 2))
+            self.vel = np.zeros((self.capacity, 2))
+            self.acc = np.zeros((self.capacity, 2))
+
+    def step(self, manager, time_delta):
+        if not self.creatures:
+            return
+
+        count = len(self.creatures)
+        self._reserve(count)
+        pos = self.pos[:count]
+        vel = self.vel[:count]
+        acc = self.acc[:count]
+        for i, creature in enumerate(self.creatures):
+            pos[i] = creature.pos
+            vel[i] = creature.vel
+        acc[:] = 0
+        targets = np.array(self.targets, dtype=float)
+
+        obstacles = list(manager.by_tag("collidable"))
+        obstacle_pos = np.array([obstacle.center for obstacle in obstacles], dtype=float).reshape(-1, 2)
+        arrive = np.array(self.arrive)
+        avoiding = np.array(self.avoiding)
+
+        # Sub-steps as in Creature.go_to. Creatures that arrived stop taking part
+        steps = Object.Creature.steering_steps(time_delta)
+        time_delta /= steps
+        arrived = np.zeros(count, dtype=bool)
+        for step in range(steps):
+            active = np.flatnonzero(~arrived)
+            if not len(active):
+                break
+            if step == 0:
+                step_pos, step_vel, step_acc = pos, vel, acc
+            else:
+                step_pos, step_vel, step_acc = pos[active], vel[active], acc[active]
+            now_arrived = self.seek(step_pos, step_vel, step_acc, targets[active], arrive[active],
+                                    Object.Creature.MAXSPEED, Object.Creature.MAXFORCE)
+            self.avoid(step_pos, step_vel, step_acc, obstacle_pos, avoiding[active], Object.Creature.MAXSPEED,
+                       Object.Creature.AVOID_RADIUS)
+            step_vel += step_acc * time_delta * 100
+            step_pos += step_vel * time_delta * 100
+            step_acc[:] = 0
+            if step > 0:
+                pos[active], vel[active] = step_pos, step_vel
+            arrived[active[now_arrived]] = True
+
+        # Writes the results back
+        for i, creature in enumerate(self.creatures):
+            creature.vel[0], creature.vel[1] = vel[i].tolist()
+            creature.pos[0], creature.pos[1] = pos[i].tolist()
+            if arrived[i]:
+                creature.moving = False
+            creature.update_rects()
+
+        self.creatures = []
+        self.targets = []
+        self.arrive = []
+        self.avoiding = []
+
+    @staticmethod
+    def seek(pos, vel, acc, targets, arrive, max_speed, max_force):
+        """
+        Adds the seek force of each creature to acc. Mirrors Creature.seek, including clamping with the
+        desired y velocity, and zeroes the velocity of creatures that arrived
+
+        :param arrive: Boolean array of creatures that slow down and stop at their target
+
+        :return: Boolean array of creatures within arrival distance of their target
+        """
+        desired = targets - pos
+        dist = np.hypot(desired[:, 0], desired[:, 1])
+        safe_dist = np.where(dist > 0, dist, 1)
+        speed = np.where((dist < 100) & arrive, dist / 100, max_speed)
+        desired = desired * (speed / safe_dist)[:, None]
+
+        steer = desired - vel
+        mag = np.hypot(steer[:, 0], steer[:, 1])
+        clamp = mag > max_force
+        scale = max_force / np.where(clamp, mag, 1)
+        steer[clamp, 0] *= scale[clamp]
+        steer[clamp, 1] = desired[clamp, 1] * scale[clamp]
+
+        arrived = (dist < 10) & arrive
+        steer[arrived] = 0
+        vel[arrived] = 0
+        acc += steer
+        return arrived
+
+    @staticmethod
+    def avoid(pos, vel, acc, obstacle_pos, avoiding, max_speed, radius):
+        """
+        Adds the avoidance force of every creature-obstacle pair closer than radius to acc. Mirrors Creature.avoid
+
+        :param avoiding: Boolean array of creatures that avoid obstacles at all
+        """
+        if not len(obstacle_pos):
+            return
+        offset = obstacle_pos[None, :, :] - pos[:, None, :]
+        dist = np.hypot(offset[..., 0], offset[..., 1])
+        active = (dist < radius) & (dist > 0) & avoiding[:, None]
+        safe_dist = np.where(active, dist, 1)
+        desired = -offset * (max_speed / safe_dist)[..., None]
+        steer = desired - vel[:, None, :]
+        acc += np.where(active[..., None], steer, 0).sum(axis=1)
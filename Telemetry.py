@@ -0,0 +1,213 @@
+"""
+Telemetry log of a running world. Objects push samples (creature stats, food spawned and eaten, calories spent) into
+an in-memory buffer, which a background thread writes out in blocks so the game thread never touches the file.
+Show a summary of a log, or convert it to CSV, with
+
+    python Telemetry.py LOG [--csv OUT]
+
+A log is a header followed by blocks. Each block holds a number of records as one array per column: kind, tick,
+source object, and three values whose meaning depends on the kind (see KINDS). A log whose buffer overflowed ends
+with a record of the number of samples dropped.
+"""
+import argparse
+import collections
+import csv
+import itertools
+import struct
+import sys
+import threading
+
+import Constants
+
+MAGIC = b"CPTL"
+VERSION = 2
+HEADER = struct.Struct("<4sHI")  # magic, version, ticks between creature samples
+BLOCK = struct.Struct("<I")  # number of records in the block
+# Format of each column of a block, in order
+COLUMNS = ("B", "I", "I", "f", "f", "f")
+RECORD_SIZE = sum(struct.calcsize(fmt) for fmt in COLUMNS)
+
+# Record kinds, and the names of their three values
+CREATURE_STATS = 0
+FOOD_SPAWNED = 1
+FOOD_EATEN = 2
+CALORIES_SPENT = 3
+SAMPLES_DROPPED = 4
+KINDS = {
+    CREATURE_STATS: ("creature_stats", ("hunger", "thirst", "happiness")),
+    FOOD_SPAWNED: ("food_spawned", ("x", "y", "type")),
+    FOOD_EATEN: ("food_eaten", ("calories", "type", "happiness_index")),
+    CALORIES_SPENT: ("calories_spent", ("amount", "remaining", "")),
+    SAMPLES_DROPPED: ("samples_dropped", ("count", "", "")),
+}
+
+# Object types by the code stored in "type" values
+TYPES = ("GUI", "Creature", "Grass", "Kibble", "Snack", "Shack", "Pond")
+TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+
+
+class InvalidTelemetry(Exception):
+    def __init__(self, reason):
+        super().__init__("Not a valid telemetry log: " + reason)
+
+
+class Telemetry:
+    """
+    Buffer of samples and the thread writing them. Pushing is a single deque append, which is atomic, so neither
+    side takes a lock. Samples pushed while the buffer is full replace the oldest ones, the number lost is written
+    to the log when it is closed
+    """
+    def __init__(self, path, sample_interval=Constants.TELEMETRY_SAMPLE_INTERVAL,
+                 flush_interval=Constants.TELEMETRY_FLUSH_INTERVAL, buffer_size=Constants.TELEMETRY_BUFFER_SIZE):
+        """
+
+        :param path: Log file to write, replaced if it exists
+        :param sample_interval: Ticks between creature stat samples
+        :param flush_interval: Seconds between writes of the buffered samples
+        :param buffer_size: Maximum number of samples waiting to be written
+        """
+        self.path = path
+        self.sample_interval = sample_interval
+        self.flush_interval = flush_interval
+        self.buffer = collections.deque(maxlen=buffer_size)
+
+        # Opened here so a path that can't be written fails on the caller's thread
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, sample_interval))
+
+        # Samples pushed by the game thread and written by the writer thread. Each is only changed by its own
+        # thread, the samples dropped are the difference once both stopped
+        self.pushed = 0
+        self.written = 0
+
+        # Tick of the current simulation step, and whether creatures sample their stats in it
+        self.tick = 0
+        self.sampling = False
+
+        # Objects are numbered in the log in the order they first appear
+        self.ids = itertools.count()
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.write_loop, name="telemetry", daemon=True)
+        self.thread.start()
+
+    # Called by the manager at the start of every simulation step
+    def begin_step(self, tick):
+        self.tick = tick
+        self.sampling = tick % self.sample_interval == 0
+
+    def object_id(self, obj):
+        if obj.telemetry_id is None:
+            obj.telemetry_id = next(self.ids)
+        return obj.telemetry_id
+
+    def push(self, kind, source, a=0.0, b=0.0, c=0.0):
+        self.buffer.append((kind, self.tick, self.object_id(source), a, b, c))
+        self.pushed += 1
+
+    # Only records a sample on sampling steps, see begin_step
+    def creature_stats(self, creature):
+        if self.sampling:
+            self.push(CREATURE_STATS, creature, creature.hunger, creature.thirst, creature.happiness)
+
+    def food_spawned(self, food):
+        self.push(FOOD_SPAWNED, food, food.center[0], food.center[1], TYPE_CODES.get(type(food).__name__, -1))
+
+    def food_eaten(self, creature, food):
+        self.push(FOOD_EATEN, creature, food.calories, TYPE_CODES.get(type(food).__name__, -1),
+                  food.happiness_index)
+
+    def calories_spent(self, gui, amount):
+        self.push(CALORIES_SPENT, gui, amount, gui.calories)
+
+    def write_loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.written += self.write_block(self.buffer)
+        self.written += self.write_block(self.buffer)
+
+    # Writes every record taken off buffer as one block, returns the number written
+    def write_block(self, buffer):
+        records = [buffer.popleft() for _ in range(len(buffer))]
+        if not records:
+            return 0
+        count = len(records)
+        f = self.file
+        f.write(BLOCK.pack(count))
+        for fmt, column in zip(COLUMNS, zip(*records)):
+            f.write(struct.pack("<{}{}".format(count, fmt), *column))
+        f.flush()
+        return count
+
+    # Writes the remaining samples, stops the writer thread and closes the log
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        dropped = self.pushed - self.written
+        if dropped:
+            print("Telemetry buffer overflowed, {} samples were dropped".format(dropped), file=sys.stderr)
+            self.write_block(collections.deque([(SAMPLES_DROPPED, self.tick, 0, dropped, 0.0, 0.0)]))
+        self.file.close()
+
+
+def read(path):
+    """
+    Reads a telemetry log. A block cut short, e.g. by a crash, ends the log
+
+    :return: (ticks between creature samples, list of (kind, tick, source, a, b, c))
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise InvalidTelemetry("file is truncated")
+    magic, version, sample_interval = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise InvalidTelemetry("bad magic number")
+    # Version 1 logs are the same, without samples_dropped records
+    if version not in (1, VERSION):
+        raise InvalidTelemetry("unsupported version {}".format(version))
+
+    records = []
+    offset = HEADER.size
+    while offset + BLOCK.size <= len(data):
+        count, = BLOCK.unpack_from(data, offset)
+        if offset + BLOCK.size + count * RECORD_SIZE > len(data):
+            break
+        offset += BLOCK.size
+        columns = []
+        for fmt in COLUMNS:
+            layout = struct.Struct("<{}{}".format(count, fmt))
+            columns.append(layout.unpack_from(data, offset))
+            offset += layout.size
+        records.extend(zip(*columns))
+    return sample_interval, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("log", help="telemetry log to read")
+    parser.add_argument("--csv", metavar="OUT", help="write every record to OUT as CSV")
+    args = parser.parse_args()
+
+    sample_interval, records = read(args.log)
+    counts = collections.Counter(record[0] for record in records)
+    ticks = [record[1] for record in records]
+    print("{} records over ticks {}-{}, creatures sampled every {} ticks".format(
+        len(records), min(ticks, default=0), max(ticks, default=0), sample_interval))
+    for kind, (name, _) in KINDS.items():
+        if kind != SAMPLES_DROPPED:
+            print("  {:<15} {}".format(name, counts[kind]))
+    dropped = sum(int(record[3]) for record in records if record[0] == SAMPLES_DROPPED)
+    if dropped:
+        print("{} samples were dropped when the buffer overflowed".format(dropped))
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("kind", "tick", "source", "a", "b", "c"))
+            for kind, tick, source, a, b, c in records:
+                writer.writerow((KINDS[kind][0], tick, source, a, b, c))
+        print("Wrote " + args.csv, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
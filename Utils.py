@@ -1,6 +1,7 @@
 import Constants
 import pygame
 import math
+from collections import OrderedDict
 
 
 # Scales a set of coordinates to the current screen size based on a divisor factor
@@ -19,12 +20,172 @@ def posscale(*coordinate, divisor=(850, 700)):
         return coordinate[0] / divisor[0] * Constants.SCREEN_SIZE[0]
 
 
-def load_image(path, size=None):
+class SurfaceCache:
+    """
+    Size-bounded LRU cache of pygame surfaces. Surfaces handed out are shared between every caller
+    asking for the same key, so they must be treated as read-only
+    """
+    def __init__(self, max_bytes):
+        """
+
+        :param max_bytes: Total pixel bytes the cache may hold before evicting the least recently used surfaces
+        """
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()  # key -> (surface, byte size)
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    @staticmethod
+    def surface_bytes(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    # Returns the surface stored under key, creating it with factory() on a miss
+    def get(self, key, factory):
+        entry = self.surfaces.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        surface = factory()
+        size = self.surface_bytes(surface)
+        self.surfaces[key] = (surface, size)
+        self.bytes += size
+
+        # Evicts least recently used surfaces, always keeping the newest one
+        while self.bytes > self.max_bytes and len(self.surfaces) > 1:
+            _, (_, evicted_size) = self.surfaces.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "bytes": self.bytes, "entries": len(self.surfaces)}
+
+
+# Shared cache used by load_image
+image_cache = SurfaceCache(Constants.IMAGE_CACHE_MAX_BYTES)
+
+# Sprites of the loaded atlas bundle by load_image arguments, see Atlas.load. They are never evicted
+image_bundle = {}
+
+
+# Loads an image scaled to size and flipped along (x, y). The same converted surface is returned for every
+# call with the same arguments, so callers must not draw onto it
+def load_image(path, size=None, flip=(False, False)):
+    size = tuple(size) if size is not None else None
+    flip = (bool(flip[0]), bool(flip[1]))
+    key = (path, size, flip)
+    surface = image_bundle.get(key)
+    if surface is not None:
+        return surface
+    return image_cache.get(key, lambda: _load_image_uncached(path, size, flip))
+
+
+def _load_image_uncached(path, size, flip):
     img = pygame.image.load(path)
     if size is not None:
         img = pygame.transform.smoothscale(img, size)
+    if flip[0] or flip[1]:
+        img = pygame.transform.flip(img, *flip)
+    # Surfaces can only be converted to the display format once a display exists (not the case when headless)
+    if pygame.display.get_surface() is None:
+        return img
     return img.convert_alpha()
 
 
+class TextCache:
+    """
+    LRU cache of rendered text surfaces keyed by (font, text, antialias, colour), so text is only rasterized
+    again when one of those changes
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()  # (font, text, antialias, colour) -> surface
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color):
+        """
+        Returns a surface with text rendered in font, like font.render(text, antialias, color). The surface is
+        shared, so it must not be drawn onto
+        """
+        key = (font, text, antialias, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.surfaces)}
+
+
+# Shared cache for HUD text
+text_cache = TextCache(Constants.TEXT_CACHE_SIZE)
+
+
+# Shared cache of rotated and flipped sprites used by rotate_image
+rotation_cache = SurfaceCache(Constants.ROTATION_CACHE_MAX_BYTES)
+
+
+# Rounds angle to the nearest multiple of step, in [0, 360)
+def quantize_angle(angle, step=None):
+    step = Constants.ROTATION_STEP if step is None else step
+    return round(angle / step) * step % 360
+
+
+def rotate_image(image, angle, flip=(False, False), step=None):
+    """
+    Returns image flipped along (x, y) and then rotated counter-clockwise by angle degrees, rounded to a multiple
+    of step. Results are cached per source surface, so rotating a sprite every frame only resamples it the first
+    time each angle comes up. The returned surface is shared and must not be drawn onto
+
+    :param step: Angle quantization in degrees, Constants.ROTATION_STEP if None
+    """
+    angle = quantize_angle(angle, step)
+    flip = (bool(flip[0]), bool(flip[1]))
+    return rotation_cache.get((image, angle, flip), lambda: _rotate_image_uncached(image, angle, flip))
+
+
+def _rotate_image_uncached(image, angle, flip):
+    if flip[0] or flip[1]:
+        image = pygame.transform.flip(image, *flip)
+    if angle == 0:
+        return image
+    return pygame.transform.rotate(image, angle)
+
+
+# Renders every quantized rotation of image ahead of time, e.g. while loading, so none happens during play
+def prerender_rotations(image, flips=((False, False),), step=None):
+    step = Constants.ROTATION_STEP if step is None else step
+    for flip in flips:
+        for i in range(int(math.ceil(360 / step))):
+            rotate_image(image, i * step, flip, step)
+
+
 def distance(p, q):
     return math.sqrt((q[1] - p[1]) ** 2 + (q[0] - p[0]) ** 2)
@@ -0,0 +1,55 @@
+import bisect
+
+
+class ZOrderedObjects:
+    """
+    Container of game objects that iterates in z_order, keeping objects with equal z_order in the order they
+    were added. Objects are bucketed by z_order in insertion ordered dicts, so adding only bisects the sorted
+    list of z values when a new one appears and removing is a single dict deletion.
+    An object's z_order must not change while it is in the container
+    """
+    def __init__(self, objects=()):
+        self.buckets = {}  # z_order -> {obj: None}
+        self.z_orders = []  # Sorted z_order values that have a bucket
+        self.count = 0
+        for obj in objects:
+            self.add(obj)
+
+    def add(self, obj):
+        bucket = self.buckets.get(obj.z_order)
+        if bucket is None:
+            bucket = self.buckets[obj.z_order] = {}
+            bisect.insort(self.z_orders, obj.z_order)
+        if obj not in bucket:
+            bucket[obj] = None
+            self.count += 1
+
+    def remove(self, obj):
+        bucket = self.buckets.get(obj.z_order)
+        if bucket is None or obj not in bucket:
+            raise KeyError(obj)
+        del bucket[obj]
+        self.count -= 1
+        if not bucket:
+            del self.buckets[obj.z_order]
+            del self.z_orders[bisect.bisect_left(self.z_orders, obj.z_order)]
+
+    def discard(self, obj):
+        if obj in self:
+            self.remove(obj)
+
+    def clear(self):
+        self.buckets = {}
+        self.z_orders = []
+        self.count = 0
+
+    def __contains__(self, obj):
+        bucket = self.buckets.get(obj.z_order)
+        return bucket is not None and obj in bucket
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for z_order in self.z_orders:
+            yield from self.buckets[z_order]
@@ -0,0 +1,184 @@
+"""
+Scenario benchmarks of the game loop. Builds worlds from the declarative scenarios below, runs each for a fixed
+number of frames without a window and reports per-frame time percentiles of the object update, render and
+update_objects phases of Manager.step, as timed by the frame profiler. Run from the repository root with
+
+    python -m benchmarks.scenarios [--scenario NAME ...] [--out results.json] [--compare previous.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+import Constants
+import Game
+import Object
+
+# Grass growth stages are reached by starting the grass at the age the stage needs
+GRASS_AGES = {"seed": 0, "sprout": Object.Grass.SEED2SPROUT_TIME, "grass": Object.Grass.SPROUT2GRASS_TIME}
+
+SCENARIOS = {
+    "default": {"creatures": 1, "grass": {"seed": 1}, "kibble": 0, "snacks": 1, "ponds": 1, "shacks": 1,
+                "frames": 2000},
+    "food_field": {"creatures": 1, "grass": {"seed": 300, "sprout": 300, "grass": 300}, "kibble": 200,
+                   "snacks": 200, "ponds": 1, "shacks": 1, "frames": 1000},
+    "pack": {"creatures": 50, "grass": {"grass": 100}, "kibble": 50, "snacks": 50, "ponds": 3, "shacks": 3,
+             "frames": 1000},
+    "crowd": {"creatures": 200, "grass": {"seed": 1000, "sprout": 1000, "grass": 1000}, "kibble": 500,
+              "snacks": 500, "ponds": 4, "shacks": 4, "frames": 300},
+    # A world 4x4 screens large, mostly outside of the viewport
+    "yard": {"world_size": (3400, 2800), "creatures": 100, "grass": {"seed": 3000, "sprout": 3000, "grass": 3000},
+             "kibble": 1000, "snacks": 1000, "ponds": 16, "shacks": 16, "frames": 300},
+}
+
+# Reported phases and the frame profiler phases (see Profiler.FrameProfiler) adding up to each, by the first word of
+# their name. Batched steering is part of the object update
+PHASES = {"run_sprite": ("run_sprite", "steering"), "render": ("render",), "update_objects": ("update_objects",)}
+
+
+def build_world(scenario, seed):
+    rng = random.Random(seed)
+    manager = Game.Manager(headless=True, populate=False, seed=seed, world_size=scenario.get("world_size"))
+
+    def random_pos(rng):
+        return rng.randint(0, manager.world_size[0]), rng.randint(0, manager.world_size[1])
+
+    manager.add_object(Object.GUI(None, 999, [i / 2 for i in Constants.SCREEN_SIZE]))
+    for _ in range(scenario.get("shacks", 0)):
+        manager.add_object(Object.Shack(None, random_pos(rng)))
+    for _ in range(scenario.get("ponds", 1)):
+        manager.add_object(Object.Pond(None, random_pos(rng)))
+    for stage, count in scenario.get("grass", {}).items():
+        for _ in range(count):
+            grass = Object.Grass(None, random_pos(rng))
+            grass.exist_time = GRASS_AGES[stage]
+            manager.add_object(grass)
+    for _ in range(scenario.get("kibble", 0)):
+        manager.add_object(Object.Kibble(None, random_pos(rng)))
+    for _ in range(scenario.get("snacks", 0)):
+        manager.add_object(Object.Snack(None, random_pos(rng)))
+    for _ in range(scenario.get("creatures", 0)):
+        manager.add_object(Object.Creature(None, list(random_pos(rng))))
+    manager.update_objects()
+    return manager
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000
+
+    return {"mean": sum(samples) / len(samples) * 1000, "p50": at(0.5), "p90": at(0.9), "p99": at(0.99),
+            "max": samples[-1] * 1000}
+
+
+# Runs Manager.advance and Manager.draw with the frame profiler timing their phases. Each frame is one simulation
+# step drawn at its end
+def run_scenario(scenario, frames, seed, dt):
+    manager = build_world(scenario, seed)
+    manager.screen = pygame.display.get_surface()
+    profiler = manager.profiler
+    profiler.enabled = True
+    timings = {phase: [] for phase in PHASES}
+    drawn = culled = 0
+    manager.events = []
+
+    for _ in range(frames):
+        profiler.begin_frame()
+        manager.advance(dt)
+        manager.draw(dt, 1.0)
+        profiler.end_frame()
+        drawn += manager.renderer.drawn
+        culled += manager.renderer.culled
+
+        row = profiler.samples[(profiler.frames - 1) % profiler.capacity].tolist()
+        totals = {phase: 0.0 for phase in PHASES}
+        for name, seconds in zip(profiler.names, row):
+            for phase, prefixes in PHASES.items():
+                if name.split(" ")[0] in prefixes:
+                    totals[phase] += seconds
+        for phase, seconds in totals.items():
+            timings[phase].append(seconds)
+
+    frame_times = [sum(phase) for phase in zip(*timings.values())]
+    result = {phase: percentiles(samples) for phase, samples in timings.items()}
+    result["frame"] = percentiles(frame_times)
+    return {"frames": frames, "objects": len(manager.game_objects), "drawn": drawn / frames, "culled": culled / frames,
+            "phases": result}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, previous=None):
+    for name, result in results["scenarios"].items():
+        print("{} ({} frames, {} objects, {:.0f} drawn and {:.0f} culled per frame)".format(
+            name, result["frames"], result["objects"], result.get("drawn", 0), result.get("culled", 0)))
+        old = previous["scenarios"].get(name) if previous is not None else None
+        if previous is not None and old is None:
+            print("  not in the previous results")
+        for phase, stats in result["phases"].items():
+            line = "  {:<15} mean {:8.3f} ms  p50 {:8.3f}  p90 {:8.3f}  p99 {:8.3f}  max {:8.3f}".format(
+                phase, stats["mean"], stats["p50"], stats["p90"], stats["p99"], stats["max"])
+            if old is not None:
+                if phase not in old["phases"]:
+                    line += "  not in previous"
+                elif old["phases"][phase]["p50"] > 0:
+                    line += "  p50 x{:.2f} vs previous".format(stats["p50"] / old["phases"][phase]["p50"])
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run, may be repeated (default: all)")
+    parser.add_argument("--frames", type=int, help="override the number of frames of every scenario")
+    parser.add_argument("--dt", type=float, default=1 / Constants.SIM_RATE,
+                        help="fixed time delta of each frame (default: 1/{}, as in the game)".format(
+                            Constants.SIM_RATE))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    args = parser.parse_args()
+
+    pygame.display.init()
+    pygame.display.set_mode(Constants.SCREEN_SIZE)
+
+    results = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "pygame": pygame.version.ver,
+        "scenarios": {},
+    }
+    for name in args.scenario or SCENARIOS:
+        scenario = SCENARIOS[name]
+        results["scenarios"][name] = run_scenario(scenario, args.frames or scenario["frames"], args.seed, args.dt)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
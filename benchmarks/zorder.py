@@ -0,0 +1,95 @@
+"""
+Micro-benchmark of adding and killing objects in Manager.game_objects: the previous sorted list against
+ZOrder.ZOrderedObjects. Run from the repository root with
+
+    python -m benchmarks.zorder [--objects 10000] [--batch 100]
+"""
+import argparse
+import random
+import time
+
+import ZOrder
+
+
+class Dummy:
+    def __init__(self, z_order):
+        self.z_order = z_order
+
+
+# The old Manager.update_objects bookkeeping: append and re-sort, then list.remove every dead object
+class SortedList:
+    def __init__(self):
+        self.objects = []
+
+    def add_batch(self, batch):
+        self.objects.extend(batch)
+        self.objects.sort(key=lambda i: i.z_order)
+
+    def kill_batch(self, batch):
+        for obj in batch:
+            if obj in self.objects:
+                self.objects.remove(obj)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+
+class Bucketed:
+    def __init__(self):
+        self.objects = ZOrder.ZOrderedObjects()
+
+    def add_batch(self, batch):
+        for obj in batch:
+            self.objects.add(obj)
+
+    def kill_batch(self, batch):
+        for obj in batch:
+            if obj in self.objects:
+                self.objects.remove(obj)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+
+def run(container, objects, batch_size, kill_order):
+    # Objects are queued in batches, as if a batch was spawned each frame
+    start = time.perf_counter()
+    for i in range(0, len(objects), batch_size):
+        container.add_batch(objects[i:i + batch_size])
+    add_time = time.perf_counter() - start
+
+    order = [id(obj) for obj in container]
+
+    # Every object expires in the same frame
+    start = time.perf_counter()
+    container.kill_batch(kill_order)
+    kill_time = time.perf_counter() - start
+    return add_time, kill_time, order
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--objects", type=int, default=10000)
+    parser.add_argument("--batch", type=int, default=100, help="objects added per frame")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # z orders used by the game's object types
+    objects = [Dummy(rng.choice((-1, 0, 1, 2, 3, 5, 999))) for _ in range(args.objects)]
+    kill_order = objects[:]
+    rng.shuffle(kill_order)
+
+    results = {}
+    for name, container in (("sorted list", SortedList()), ("z buckets", Bucketed())):
+        add_time, kill_time, order = run(container, objects, args.batch, kill_order)
+        results[name] = order
+        print("{:<12} add {:>12,.0f} objects/s   kill {:>12,.0f} objects/s".format(
+            name, args.objects / add_time, args.objects / kill_time))
+
+    if results["sorted list"] != results["z buckets"]:
+        raise AssertionError("iteration order differs between containers")
+
+
+if __name__ == "__main__":
+    main()
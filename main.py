@@ -1,5 +1,95 @@
+import argparse
+import random
+import time
+
 import pygame
+import Constants
 import Game
+import Replay
+
+parser = argparse.ArgumentParser(description="CalPal")
+parser.add_argument("--headless", type=float, metavar="SECONDS",
+                    help="simulate SECONDS of pet life without a window, as fast as possible")
+parser.add_argument("--dt", type=float, default=1 / Constants.SIM_RATE,
+                    help="fixed time delta of each simulation step in headless mode "
+                         "(default: 1/{}, as in the game)".format(Constants.SIM_RATE))
+parser.add_argument("--dirty-rects", action="store_true",
+                    help="only redraw the parts of the screen that changed (toggle in game with F2)")
+parser.add_argument("--profile", metavar="PATH",
+                    help="time every phase of the game loop and write the profile to PATH as CSV on exit")
+parser.add_argument("--load", metavar="PATH", help="start from the world saved in PATH")
+parser.add_argument("--autosave", metavar="PATH",
+                    help="save the world to PATH every {} seconds of game time".format(Constants.AUTOSAVE_INTERVAL))
+parser.add_argument("--stream", metavar="DIR",
+                    help="keep only the chunks of the world near creatures and the view in memory, evicting the "
+                         "others to DIR. The whole yard is left in DIR on exit and picked up again by the next "
+                         "session streaming from it. Streamed worlds don't replay exactly")
+parser.add_argument("--telemetry", metavar="PATH",
+                    help="log creature stats, food and calories spent to PATH, see Telemetry.py")
+parser.add_argument("--seed", type=int, help="seed the world so it behaves the same for the same input")
+parser.add_argument("--record", metavar="PATH",
+                    help="record the input of the session to PATH, to be replayed with --replay")
+parser.add_argument("--replay", metavar="PATH",
+                    help="replay a recorded session without a window, as fast as possible, and check it ends "
+                         "in the recorded state")
+args = parser.parse_args()
+
+if args.dirty_rects:
+    Constants.DIRTY_RECT_RENDERING = True
+if args.profile:
+    Constants.PROFILER_ENABLED = True
+
+
+# Streaming starts before the world is loaded, so a loaded snapshot replaces the chunks an earlier session left in the
+# stream directory instead of being replaced by them
+def prepare(manager):
+    if args.stream:
+        manager.enable_streaming(args.stream)
+    if args.load:
+        manager.load(args.load)
+    if args.autosave:
+        manager.enable_autosave(args.autosave)
+    if args.telemetry:
+        manager.enable_telemetry(args.telemetry)
+    return manager
+
+
+if args.replay:
+    # Reproduces a recorded session frame by frame
+    start = time.perf_counter()
+    manager, frames, matches = Replay.replay(args.replay, lambda seed: prepare(Game.Manager(headless=True, seed=seed)))
+    elapsed = time.perf_counter() - start
+    print("Replayed {} frames in {:.2f}s, final state {}".format(
+        frames, elapsed, "matches the recording" if matches else "DIFFERS from the recording"))
+    manager.disable_autosave()
+    manager.disable_streaming(keep_on_disk=True)
+    manager.disable_telemetry()
+elif args.headless is not None:
+    # Fast-forwards the world and reports how it went
+    manager = prepare(Game.Manager(headless=True, seed=args.seed))
+    start = time.perf_counter()
+    frames = manager.simulate(args.headless, args.dt)
+    elapsed = time.perf_counter() - start
+    print("Simulated {} frames ({:.1f}s of game time) in {:.2f}s".format(frames, frames * args.dt, elapsed))
+    for creature in manager.by_tag("creature"):
+        print("Creature hunger {:.1f} thirst {:.1f} happiness {:.1f}".format(
+            creature.hunger, creature.thirst, creature.happiness))
+    print("Pooled objects: {constructed} constructed, {reused} reused, {released} released, {dropped} dropped".format(
+        **manager.pool_counts) + " ({:.0%} reuse)".format(manager.pool_reuse_rate()))
+    manager.disable_autosave()
+    manager.disable_streaming(keep_on_disk=True)
+    manager.disable_telemetry()
+else:
+    # Initiates Manager. Recording needs a seeded world, so one is picked if none was given. It starts before the
+    # world is loaded, so the recording holds the loaded snapshot
+    seed = args.seed
+    if args.record and seed is None:
+        seed = random.randrange(2 ** 32)
+    manager = Game.Manager(seed=seed)
+    if args.record:
+        manager.start_recording(args.record)
+    prepare(manager)
+    manager.start_game()
 
-# Initiates Manager
-Game.Manager().start_game()
+if args.profile:
+    manager.profiler.dump(args.profile)